@@ -0,0 +1,206 @@
+# benchmark.py
+# mide el tiempo de cada etapa del pipeline sobre una carpeta de imagenes (por defecto data/placas)
+# el OCR se reemplaza por MockOCR con latencia configurable; el resultado se guarda en JSON
+import os
+import cv2
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+from ocr import MockOCR, encode_image
+from utils import (create_mask, find_largest_contour, get_warp_from_box, preprocess_plate, pyr_downscale, get_bgr_lut,
+                   gate_contour, gate_warp)
+from config import DEFAULT, load_config
+from ingest import iter_images, read_image
+
+STAGES = ["imread", "pyr_downscale", "create_mask", "find_largest_contour", "gate_contour", "get_warp_from_box",
+          "gate_warp", "preprocess_plate", "encode", "ocr", "total"]
+
+# run_image: ejecuta el pipeline sobre una imagen y devuelve los tiempos (s) por etapa
+# las etapas que no se alcanzan (sin contorno, warp vacio, rechazo de la compuerta) quedan fuera; el fallo
+# es la etapa donde se detuvo o el motivo de la compuerta (gate_area, gate_edges, ...)
+
+def run_image(path, engine, detect_width=None, lut=None, cfg=DEFAULT, decode_reduce=1):
+    times = {}
+    t_start = time.perf_counter()
+
+    t0 = time.perf_counter()
+    bgr = read_image(path, decode_reduce)
+    times["imread"] = time.perf_counter() - t0
+    if bgr is None:
+        return times, "imread"
+
+    t0 = time.perf_counter()
+    small, (sx, sy) = pyr_downscale(bgr, detect_width)
+    times["pyr_downscale"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    mask, kernel = create_mask(small, *cfg.hsv.bounds(), lut=lut)
+    times["create_mask"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    cnt, box = find_largest_contour(mask, kernel)
+    times["find_largest_contour"] = time.perf_counter() - t0
+    if cnt is None:
+        return times, "find_largest_contour"
+
+    # misma compuerta que locate_plate / find_warps: sobre la mascara reducida, antes de escalar la caja
+    if cfg.gate.enabled:
+        t0 = time.perf_counter()
+        reason = gate_contour(cnt, box, mask, cfg.gate)
+        times["gate_contour"] = time.perf_counter() - t0
+        if reason is not None:
+            return times, reason
+    box = box * np.array([sx, sy], dtype=np.float32)
+
+    t0 = time.perf_counter()
+    warp, M, size = get_warp_from_box(box, bgr, target_h=cfg.warp.target_h, min_w=cfg.warp.min_w,
+                                      expand_px=cfg.warp.expand_px)
+    times["get_warp_from_box"] = time.perf_counter() - t0
+    if warp is None:
+        return times, "get_warp_from_box"
+
+    if cfg.gate.enabled:
+        t0 = time.perf_counter()
+        reason = gate_warp(warp, cfg.gate)
+        times["gate_warp"] = time.perf_counter() - t0
+        if reason is not None:
+            return times, reason
+
+    t0 = time.perf_counter()
+    plate = preprocess_plate(warp, params=cfg.preprocess, gray=True)
+    times["preprocess_plate"] = time.perf_counter() - t0
+    if plate is None:
+        return times, "preprocess_plate"
+
+    t0 = time.perf_counter()
+    encode_image(plate)
+    times["encode"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    engine.read(plate)
+    times["ocr"] = time.perf_counter() - t0
+
+    times["total"] = time.perf_counter() - t_start
+    return times, None
+
+def summarize(samples):
+    arr = np.asarray(samples, dtype=np.float64)
+    if arr.size == 0:
+        return {"n": 0}
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    mean = float(arr.mean())
+    return {
+        "n": int(arr.size),
+        "mean_ms": mean * 1000,
+        "p50_ms": float(p50) * 1000,
+        "p95_ms": float(p95) * 1000,
+        "p99_ms": float(p99) * 1000,
+        "max_ms": float(arr.max()) * 1000,
+        "throughput_per_s": 1.0 / mean if mean > 0 else None,
+    }
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmark(folder="data/placas", repeat=3, warmup=1, ocr_latency=0.0, ocr_jitter=0.0, limit=None,
+                  detect_width=None, color_lut=False, cfg=DEFAULT, decode_reduce=1):
+    files = list(iter_images(folder))
+    if limit:
+        files = files[:limit]
+    if not files:
+        print("[BENCH] No se encontraron imagenes en", folder)
+        return None
+
+    engine = MockOCR(latency=ocr_latency, jitter=ocr_jitter)
+    lut = get_bgr_lut(*cfg.hsv.bounds()) if color_lut else None
+    samples = {stage: [] for stage in STAGES}
+    failures = {}
+
+    # corridas de calentamiento (cache de disco, inicializacion de OpenCV) que no se cuentan
+    for _ in range(warmup):
+        for fname in files:
+            run_image(os.path.join(folder, fname), engine, detect_width, lut, cfg, decode_reduce)
+
+    t_start = time.perf_counter()
+    for _ in range(repeat):
+        for fname in files:
+            times, failed = run_image(os.path.join(folder, fname), engine, detect_width, lut, cfg, decode_reduce)
+            for stage, value in times.items():
+                samples[stage].append(value)
+            if failed:
+                failures[failed] = failures.get(failed, 0) + 1
+    wall = time.perf_counter() - t_start
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "folder": folder,
+            "images": len(files),
+            "repeat": repeat,
+            "warmup": warmup,
+            "ocr_latency_s": ocr_latency,
+            "ocr_jitter_s": ocr_jitter,
+            "detect_width": detect_width,
+            "color_lut": color_lut,
+            "decode_reduce": decode_reduce,
+            "config": cfg.to_dict(),
+            "python": sys.version.split()[0],
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "cv2_threads": cv2.getNumThreads(),
+        },
+        "wall_s": wall,
+        "images_per_s": len(files) * repeat / wall if wall > 0 else None,
+        "failures": failures,
+        "stages": {stage: summarize(samples[stage]) for stage in STAGES},
+    }
+
+def print_report(result):
+    print(f"\n[BENCH] {result['meta']['images']} imagenes x {result['meta']['repeat']} | "
+          f"{result['images_per_s']:.2f} img/s | fallos: {result['failures']}")
+    print(f"{'etapa':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'op/s':>10}")
+    for stage, s in result["stages"].items():
+        if not s["n"]:
+            continue
+        print(f"{stage:<22}{s['n']:>6}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}"
+              f"{s['throughput_per_s']:>10.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark por etapa del pipeline de placas")
+    parser.add_argument("folder", nargs="?", default="data/placas")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=None, help="usar solo las primeras N imagenes")
+    parser.add_argument("--ocr-latency", type=float, default=0.0, help="latencia simulada del OCR en segundos")
+    parser.add_argument("--ocr-jitter", type=float, default=0.0)
+    parser.add_argument("--detect-width", type=int, default=None,
+                        help="ancho maximo para la deteccion (piramide)")
+    parser.add_argument("--color-lut", action="store_true", help="mascara con tabla BGR precalculada")
+    parser.add_argument("--decode-reduce", type=int, choices=[1, 2, 4, 8], default=1,
+                        help="decodificar el JPEG reducido 1/N")
+    parser.add_argument("--config", default=None, help="archivo TOML/YAML de configuracion del pipeline")
+    parser.add_argument("--json", default="benchmark.json", help="archivo de salida JSON")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.folder, repeat=args.repeat, warmup=args.warmup, ocr_latency=args.ocr_latency,
+                           ocr_jitter=args.ocr_jitter, limit=args.limit, detect_width=args.detect_width,
+                           color_lut=args.color_lut, cfg=load_config(args.config) if args.config else DEFAULT,
+                           decode_reduce=args.decode_reduce)
+    if result is not None:
+        print_report(result)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print("[BENCH] Resultado guardado en", args.json)
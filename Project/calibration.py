@@ -0,0 +1,281 @@
+# calibration.py
+# calibracion automatica de los umbrales HSV de la mascara por camara y franja horaria
+# Cada deteccion confirmada (el OCR devolvio una placa con formato AAA 999) aporta el histograma HSV de
+# los pixeles de fondo de la placa (dentro del warp y de una ventana amplia de amarillos, PRIOR).
+# Los histogramas se acumulan con olvido exponencial por (camara, franja) y de ellos salen los umbrales
+# por percentiles; asi la mascara sigue los cambios de luz (dia / noche) sin sesiones de click_hsv.
+# Con pocas muestras en la franja se usan los umbrales de la configuracion.
+#   python calibration.py fit data/placas --camera default --out calibracion.npz
+#   python calibration.py show calibracion.npz
+import os
+import time
+import argparse
+import tempfile
+import threading
+import cv2
+import numpy as np
+from dataclasses import replace
+from config import HSVConfig, DEFAULT
+from ingest import iter_images, read_image
+from utils import find_plate_box, find_plate_candidates_box, get_warp_from_box, preprocess_plate
+from ocr_clean import clean_ocr_text, edit_distance, PLATE_RE
+from ocr_local import TemplateOCR
+
+# ventana amplia de amarillos: limita lo que se aprende (nunca se sale de aqui)
+PRIOR = HSVConfig(hmin=8, hmax=40, smin=60, smax=255, vmin=60, vmax=255)
+
+# franjas horarias (nombre, hora de inicio)
+BUCKETS = (("madrugada", 0), ("manana", 6), ("tarde", 12), ("noche", 18))
+
+# histograma concatenado: H (180 bins), S (256), V (256)
+H_BINS, S_BINS, V_BINS = 180, 256, 256
+
+def time_bucket(when=None):
+    hour = time.localtime(time.time() if when is None else when).tm_hour
+    name = BUCKETS[0][0]
+    for bucket, start in BUCKETS:
+        if hour >= start:
+            name = bucket
+    return name
+
+# bucket_time: una hora cualquiera dentro de la franja (para forzar la franja en observe / bounds)
+
+def bucket_time(bucket):
+    return time.mktime((2000, 1, 1, dict(BUCKETS)[bucket], 0, 0, 0, 0, -1))
+
+# plate_histogram: histograma HSV de los pixeles de fondo de la placa rectificada (warp BGR)
+# devuelve None si la ventana amplia cubre menos de min_fill del warp (probablemente no es una placa)
+
+def plate_histogram(warp, min_fill=0.25, prior=PRIOR):
+    if warp is None or warp.size == 0:
+        return None
+    hsv = cv2.cvtColor(warp, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, (prior.hmin, prior.smin, prior.vmin), (prior.hmax, prior.smax, prior.vmax))
+    if cv2.countNonZero(mask) < min_fill * mask.size:
+        return None
+    h = cv2.calcHist([hsv], [0], mask, [H_BINS], [0, H_BINS])
+    s = cv2.calcHist([hsv], [1], mask, [S_BINS], [0, S_BINS])
+    v = cv2.calcHist([hsv], [2], mask, [V_BINS], [0, V_BINS])
+    return np.concatenate([h, s, v]).ravel()
+
+def _percentile(hist, q):
+    c = np.cumsum(hist)
+    return int(np.searchsorted(c, q * c[-1]))
+
+# fit_bounds: umbrales desde un histograma; H entre percentiles lo_h..hi_h, S y V desde el percentil lo
+# (el maximo queda en 255: mas brillo o saturacion no deja de ser placa), con margen y dentro de PRIOR
+
+def fit_bounds(hist, lo_h=0.02, hi_h=0.98, lo=0.15, margins=(2, 10, 10), prior=PRIOR):
+    h, s, v = hist[:H_BINS], hist[H_BINS:H_BINS + S_BINS], hist[H_BINS + S_BINS:]
+    mh, ms, mv = margins
+    return HSVConfig(hmin=max(prior.hmin, _percentile(h, lo_h) - mh),
+                     hmax=min(prior.hmax, _percentile(h, hi_h) + mh),
+                     smin=max(prior.smin, _percentile(s, lo) - ms), smax=prior.smax,
+                     vmin=max(prior.vmin, _percentile(v, lo) - mv), vmax=prior.vmax)
+
+# HSVCalibrator: histogramas por (camara, franja) con olvido exponencial (decay por observacion)
+# los umbrales se recalculan cada refit observaciones (no en cada una: la tabla BGR de color_lut y la
+# mascara no deberian cambiar por ruido) y el archivo se guarda cada autosave observaciones
+
+class HSVCalibrator:
+    def __init__(self, path=None, decay=0.98, min_samples=20, refit=10, autosave=50):
+        self.path = path
+        self.decay = decay
+        self.min_samples = min_samples
+        self.refit = refit
+        self.autosave = autosave
+        self.hists = {}    # (camara, franja) -> histograma normalizado acumulado
+        self.samples = {}  # (camara, franja) -> muestras efectivas (con olvido)
+        self._bounds = {}  # (camara, franja) -> (HSVConfig, observaciones desde el ultimo ajuste)
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # un guardado a la vez; el ultimo en escribir tiene el ultimo estado
+        if path and os.path.exists(path):
+            self.load(path)
+
+    # observe: agrega el histograma de una deteccion confirmada
+    def observe(self, camera, hist, when=None):
+        if hist is None:
+            return
+        key = (camera, time_bucket(when))
+        # cada deteccion pesa lo mismo, sin importar el tamano de la placa
+        hist = np.asarray(hist, dtype=np.float64) / max(hist[:H_BINS].sum(), 1.0)
+        with self._lock:
+            prev = self.hists.get(key)
+            self.hists[key] = hist if prev is None else prev * self.decay + hist
+            self.samples[key] = self.samples.get(key, 0.0) * self.decay + 1.0
+            self._unsaved += 1
+            save = self.path and self.autosave and self._unsaved >= self.autosave
+        if save:
+            self.save()
+
+    # bounds: HSVConfig calibrado de la camara en esa hora, o default si aun no hay muestras suficientes
+    def bounds(self, camera, when=None, default=None):
+        key = (camera, time_bucket(when))
+        with self._lock:
+            if self.samples.get(key, 0.0) < self.min_samples:
+                return default
+            cached = self._bounds.get(key)
+            if cached is not None and cached[1] < self.refit:
+                self._bounds[key] = (cached[0], cached[1] + 1)
+                return cached[0]
+            fitted = fit_bounds(self.hists[key])
+            self._bounds[key] = (fitted, 0)
+            return fitted
+
+    # apply: copia de la Config con los umbrales HSV calibrados (o la misma si no hay calibracion)
+    def apply(self, cfg, camera, when=None):
+        hsv = self.bounds(camera, when)
+        return cfg if hsv is None else replace(cfg, hsv=hsv)
+
+    def reset(self, camera, bucket):
+        with self._lock:
+            for d in (self.hists, self.samples, self._bounds):
+                d.pop((camera, bucket), None)
+
+    # save: escritura atomica (archivo temporal unico + replace), para no dejar un archivo a medias
+    def save(self, path=None):
+        path = path or self.path
+        with self._save_lock:
+            with self._lock:
+                keys = sorted(self.hists)
+                hists = np.array([self.hists[k] for k in keys]) if keys else np.zeros((0, H_BINS + S_BINS + V_BINS))
+                samples = np.array([self.samples[k] for k in keys])
+                self._unsaved = 0
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp",
+                                             delete=False) as f:
+                np.savez(f, cameras=np.array([k[0] for k in keys], dtype=str),
+                         buckets=np.array([k[1] for k in keys], dtype=str), hists=hists, samples=samples)
+            os.replace(f.name, path)
+
+    def load(self, path):
+        data = np.load(path)
+        with self._lock:
+            for camera, bucket, hist, n in zip(data["cameras"], data["buckets"], data["hists"], data["samples"]):
+                key = (str(camera), str(bucket))
+                self.hists[key] = hist
+                self.samples[key] = float(n)
+                self._bounds.pop(key, None)
+        print(f"[CALIB] Calibracion cargada de {path} ({len(data['samples'])} camara/franja)")
+
+    # summary: [(camara, franja, muestras, HSVConfig o None)]
+    def summary(self):
+        with self._lock:
+            keys = sorted(self.hists)
+            return [(cam, bucket, self.samples[(cam, bucket)],
+                     fit_bounds(self.hists[(cam, bucket)]) if self.samples[(cam, bucket)] >= self.min_samples
+                     else None) for cam, bucket in keys]
+
+# fit_folder: calibracion offline desde una carpeta con placas (p.ej. data/placas): se detecta con la
+# ventana amplia PRIOR. Con engine el nombre del archivo es la etiqueta (BOT577.jpg -> BOT577, como en
+# evaluate.py) y hace de confirmacion, como el OCR en linea: de hasta 3 candidatas se usa la que el OCR
+# lee mas cerca de la etiqueta, y la imagen se salta si no tiene etiqueta de placa o si ninguna lectura
+# queda a max_errors caracteres. Sin engine se toma el candidato con mejor forma de placa
+
+def fit_folder(calibrator, folder, camera, bucket=None, recursive=False, cfg=None, engine=None, max_errors=2):
+    cfg = cfg or DEFAULT
+    used = total = 0
+    for fname in iter_images(folder, recursive=recursive):
+        path = os.path.join(folder, fname)
+        label = os.path.splitext(os.path.basename(fname))[0].upper()
+        if engine is not None and not PLATE_RE.match(label):
+            continue
+        bgr = read_image(path)
+        if bgr is None:
+            continue
+        total += 1
+        found = find_plate_candidates_box(bgr, *PRIOR.bounds(), max_width=1024,
+                                          max_candidates=1 if engine is None else 3, gate=cfg.gate)
+        best, best_errors = None, max_errors + 1
+        for score, cnt, box in found:
+            warp, M, size = get_warp_from_box(box, bgr, target_h=cfg.warp.target_h, min_w=cfg.warp.min_w,
+                                              expand_px=0)
+            if warp is None:
+                continue
+            if engine is None:
+                best = warp
+                break
+            plate = preprocess_plate(warp, params=cfg.preprocess, gray=True)
+            text = engine.read(plate) if plate is not None else None
+            errors = edit_distance(clean_ocr_text(text)[0].replace(" ", ""), label)
+            if errors < best_errors:
+                best, best_errors = warp, errors
+        if best is None:
+            continue
+        hist = plate_histogram(best)
+        if hist is None:
+            continue
+        # la franja sale de la hora del archivo, salvo que se indique
+        when = bucket_time(bucket) if bucket else os.path.getmtime(path)
+        calibrator.observe(camera, hist, when)
+        used += 1
+    return used, total
+
+# count_detections: imagenes de la carpeta donde la mascara encuentra contorno con estos umbrales
+
+def count_detections(folder, hsv, recursive=False):
+    found = total = 0
+    for fname in iter_images(folder, recursive=recursive):
+        bgr = read_image(os.path.join(folder, fname))
+        if bgr is None:
+            continue
+        total += 1
+        cnt, box = find_plate_box(bgr, *hsv.bounds(), max_width=1024)
+        found += cnt is not None
+    return found, total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibracion de umbrales HSV por camara y franja horaria")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_fit = sub.add_parser("fit", help="ajustar umbrales desde una carpeta con placas")
+    p_fit.add_argument("folders", nargs="+")
+    p_fit.add_argument("--camera", default="default")
+    p_fit.add_argument("--bucket", choices=[b for b, _ in BUCKETS], default=None,
+                       help="franja horaria (por defecto la de la fecha de cada archivo)")
+    p_fit.add_argument("--out", default="calibracion.npz")
+    p_fit.add_argument("--recursive", action="store_true")
+    p_fit.add_argument("--min-samples", type=int, default=5)
+    p_fit.add_argument("--templates", default="ocr_templates.npz")
+    p_fit.add_argument("--no-labels", action="store_true",
+                       help="no confirmar con el nombre del archivo (la placa) y el OCR local")
+    p_fit.add_argument("--max-errors", type=int, default=2,
+                       help="caracteres distintos tolerados entre la lectura y el nombre del archivo")
+    p_fit.add_argument("--check", nargs="*", default=None,
+                       help="carpetas donde comparar detecciones con los umbrales actuales y los ajustados")
+    p_show = sub.add_parser("show", help="mostrar los umbrales guardados")
+    p_show.add_argument("path", nargs="?", default="calibracion.npz")
+    args = parser.parse_args()
+
+    if args.cmd == "show":
+        cal = HSVCalibrator(args.path)
+        for cam, bucket, n, hsv in cal.summary():
+            print(f"[CALIB] {cam:12s} {bucket:10s} muestras {n:7.1f} | {hsv.bounds() if hsv else 'insuficientes'}")
+        raise SystemExit(0)
+
+    # offline todas las imagenes pesan igual (sin olvido); la franja ajustada reemplaza a la guardada
+    cal = HSVCalibrator(args.out, decay=1.0, min_samples=args.min_samples, autosave=0)
+    if args.bucket:
+        cal.reset(args.camera, args.bucket)
+    else:
+        for bucket, _ in BUCKETS:
+            cal.reset(args.camera, bucket)
+    engine = None if args.no_labels else TemplateOCR(model_path=args.templates)
+    if engine is not None:
+        engine.warmup()
+    for folder in args.folders:
+        used, total = fit_folder(cal, folder, args.camera, args.bucket, args.recursive, engine=engine,
+                                 max_errors=args.max_errors)
+        print(f"[CALIB] {folder}: {used}/{total} imagenes con placa usadas")
+    cal.save()
+    print("[CALIB] Guardado en", args.out)
+
+    for cam, bucket, n, hsv in cal.summary():
+        if cam != args.camera or hsv is None:
+            continue
+        print(f"\n[CALIB] {cam} / {bucket} ({n:.0f} muestras): {hsv}")
+        print("[hsv]\n" + "\n".join(f"{k} = {v}" for k, v in zip(("hmin", "hmax", "smin", "smax", "vmin", "vmax"),
+                                                                 hsv.bounds())))
+        for folder in args.check or []:
+            before, total = count_detections(folder, DEFAULT.hsv, args.recursive)
+            after, _ = count_detections(folder, hsv, args.recursive)
+            print(f"[CALIB] {folder}: detecciones {before}/{total} (actuales) -> {after}/{total} (ajustados)")
@@ -0,0 +1,160 @@
+# config.py
+# configuracion del pipeline en un solo objeto tipado (umbrales HSV, warp, preprocesado y OCR)
+# se lee de un archivo TOML (o YAML si esta instalado PyYAML); ConfigStore vuelve a leer el archivo
+# cuando cambia, asi se puede reajustar (noche, camara nueva) sin reiniciar el proceso ni perder
+# el modelo cargado y las caches
+import os
+import time
+import threading
+import tomllib
+from dataclasses import dataclass, field, fields, asdict
+
+try:
+    import yaml
+except ImportError:  # TOML funciona sin dependencias extra
+    yaml = None
+
+@dataclass(frozen=True)
+class HSVConfig:
+    hmin: int = 17
+    hmax: int = 27
+    smin: int = 160
+    smax: int = 255
+    vmin: int = 190
+    vmax: int = 255
+
+    def bounds(self):
+        return self.hmin, self.hmax, self.smin, self.smax, self.vmin, self.vmax
+
+@dataclass(frozen=True)
+class WarpConfig:
+    target_h: int = 240
+    min_w: int = 120
+    expand_px: int = 8
+
+@dataclass(frozen=True)
+class PreprocessConfig:
+    clahe_clip: float = 2.0
+    clahe_tile: int = 8
+    bilateral_d: int = 5
+    bilateral_sigma_color: float = 50.0
+    bilateral_sigma_space: float = 50.0
+    sharpen_sigma: float = 1.0
+    sharpen_amount: float = 0.5
+
+# compuerta de rechazo temprano: lo que no parece placa no llega al warp / OCR (ver utils.gate_contour)
+@dataclass(frozen=True)
+class GateConfig:
+    enabled: bool = True
+    min_area_frac: float = 0.001    # area del contorno / area del cuadro
+    min_fill: float = 0.3           # pixeles de la mascara dentro de la caja alineada
+    min_aspect: float = 1.4         # lado largo / lado corto de la caja
+    max_aspect: float = 4.5
+    min_edge_density: float = 0.08  # bordes Canny en el warp reducido
+    min_chars: int = 3              # componentes con tamano de caracter en el warp
+
+@dataclass(frozen=True)
+class OCRConfig:
+    model: str = "moondream"
+    temperature: float = 0.0
+    num_predict: int = 16
+    keep_alive: str = "30m"
+    timeout: float = 120.0
+    retries: int = 2
+
+    def options(self):
+        return {"temperature": self.temperature, "num_predict": self.num_predict}
+
+@dataclass(frozen=True)
+class Config:
+    hsv: HSVConfig = field(default_factory=HSVConfig)
+    warp: WarpConfig = field(default_factory=WarpConfig)
+    preprocess: PreprocessConfig = field(default_factory=PreprocessConfig)
+    gate: GateConfig = field(default_factory=GateConfig)
+    ocr: OCRConfig = field(default_factory=OCRConfig)
+
+    def to_dict(self):
+        return asdict(self)
+
+DEFAULT = Config()
+
+# _build: arma una seccion desde un dict; rechaza claves desconocidas y convierte al tipo del campo
+
+def _build(cls, data, section):
+    if not isinstance(data, dict):
+        raise ValueError(f"seccion [{section}]: se esperaba una tabla")
+    types = {f.name: f.type for f in fields(cls)}
+    unknown = set(data) - set(types)
+    if unknown:
+        raise ValueError(f"seccion [{section}]: claves desconocidas {sorted(unknown)}")
+    values = {}
+    for name, value in data.items():
+        kind = types[name]
+        if kind is bool and not isinstance(value, bool):
+            raise ValueError(f"{section}.{name}: se esperaba true/false, llego {value!r}")
+        if kind is int and isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"{section}.{name}: se esperaba un entero, llego {value}")
+        try:
+            values[name] = kind(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{section}.{name}: valor invalido {value!r}")
+    return cls(**values)
+
+def from_dict(data):
+    sections = {f.name: f.type for f in fields(Config)}
+    unknown = set(data) - set(sections)
+    if unknown:
+        raise ValueError(f"secciones desconocidas {sorted(unknown)}")
+    return Config(**{name: _build(cls, data[name], name) for name, cls in sections.items() if name in data})
+
+def load_config(path):
+    if path.lower().endswith((".yaml", ".yml")):
+        if yaml is None:
+            raise ImportError("leer YAML requiere PyYAML (pip install pyyaml); usar TOML si no esta")
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+    else:
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    return from_dict(data)
+
+# ConfigStore: configuracion actual + recarga en caliente
+# get() revisa la fecha de modificacion del archivo como maximo cada `interval` segundos;
+# si el archivo nuevo tiene errores se mantiene la configuracion anterior. `version` cambia con cada
+# recarga para que quien tenga estado derivado (motor OCR, tabla de color) sepa que debe actualizarlo
+
+class ConfigStore:
+    def __init__(self, path=None, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.version = 0
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self._config = DEFAULT
+        if path:
+            self._mtime = os.path.getmtime(path)
+            self._config = load_config(path)
+            print(f"[CONFIG] Configuracion cargada de {path}")
+
+    def get(self):
+        if not self.path:
+            return self._config
+        now = time.monotonic()
+        if now - self._checked < self.interval:
+            return self._config
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return self._config
+            if mtime != self._mtime:
+                self._mtime = mtime
+                try:
+                    self._config = load_config(self.path)
+                    self.version += 1
+                    print(f"[CONFIG] Configuracion recargada de {self.path} (version {self.version})")
+                except Exception as e:
+                    print(f"[CONFIG] ERROR en {self.path}, se mantiene la configuracion anterior:", str(e))
+        return self._config
@@ -0,0 +1,133 @@
+# debug.py
+# artefactos de depuracion (mascara, contornos, puntos, warp, placa preprocesada) fuera del camino caliente
+# Desactivado por defecto: begin() devuelve None y cada etapa solo revisa `if dbg is not None`.
+# Con configure() se activa un sumidero con muestreo, nombres por imagen y un hilo escritor: las etapas
+# solo guardan referencias a los arreglos, y el dibujo y la codificacion se hacen en el hilo escritor.
+import os
+import queue
+import random
+import threading
+import cv2
+import numpy as np
+from multiprocessing import util
+
+_sink = None
+
+# DebugRecord: artefactos de una imagen; add() guarda la imagen y opcionalmente una funcion de dibujo
+# que se aplica sobre una copia en el hilo escritor
+
+class DebugRecord:
+    def __init__(self, sink, name, sampled):
+        self.sink = sink
+        self.name = name
+        self.sampled = sampled
+        self.items = []
+
+    def add(self, stage, img, draw=None):
+        if img is None:
+            return
+        # la misma etapa repetida (varias candidatas) se numera: points, points_1, ...
+        n = sum(1 for s, _, _ in self.items if s == stage or s.startswith(stage + "_"))
+        self.items.append((f"{stage}_{n}" if n else stage, img, draw))
+
+    # finish: failed = motivo de fallo (o None); decide si se escribe segun el muestreo del sumidero
+    def finish(self, failed=None):
+        self.sink.submit(self, failed)
+
+class DebugSink:
+    def __init__(self, out_dir="debug", sample=1.0, failures_only=False, max_queue=64, seed=None):
+        self.out_dir = out_dir
+        self.sample = sample
+        self.failures_only = failures_only
+        self.written = 0
+        self.dropped = 0
+        self._rng = random.Random(seed)
+        self._queue = queue.Queue(maxsize=max_queue)
+        os.makedirs(out_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def begin(self, name):
+        sampled = self.sample >= 1.0 or self._rng.random() < self.sample
+        # con failures_only se guardan las referencias siempre: solo se sabe al final si la imagen fallo
+        if not sampled and not self.failures_only:
+            return None
+        return DebugRecord(self, name, sampled)
+
+    def submit(self, record, failed=None):
+        if failed is None and (self.failures_only or not record.sampled):
+            return
+        if not record.items:
+            return
+        try:
+            # si el disco va atrasado se descarta el artefacto en vez de frenar el pipeline
+            self._queue.put_nowait((record, failed))
+        except queue.Full:
+            self.dropped += 1
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            record, failed = item
+            prefix = record.name if failed is None else f"{record.name}_{failed}"
+            for stage, img, draw in record.items:
+                try:
+                    if draw is not None:
+                        img = draw(img.copy())
+                    ext = ".png" if img.ndim == 2 else ".jpg"
+                    cv2.imwrite(os.path.join(self.out_dir, f"{prefix}_{stage}{ext}"), img)
+                    self.written += 1
+                except Exception as e:
+                    print(f"[DEBUG] ERROR escribiendo {prefix}_{stage}:", str(e))
+            self._queue.task_done()
+
+    # close: espera a que se escriba lo pendiente y detiene el hilo
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+def configure(out_dir="debug", sample=1.0, failures_only=False, max_queue=64, seed=None):
+    global _sink
+    if _sink is not None:
+        _sink.close()
+    _sink = DebugSink(out_dir, sample=sample, failures_only=failures_only, max_queue=max_queue, seed=seed)
+    # tambien en los procesos del pool (que terminan sin correr atexit) se vacia la cola al salir
+    util.Finalize(_sink, _sink.close, exitpriority=10)
+    return _sink
+
+# artifact_name: nombre de artefactos a partir de la ruta relativa a la carpeta de entrada; con --recursive
+# las subcarpetas quedan en el nombre (cam1/ABC123.jpg -> cam1__ABC123), asi dos imagenes con el mismo
+# nombre en carpetas distintas no se sobreescriben
+
+def artifact_name(rel_path):
+    stem = os.path.splitext(os.path.normpath(rel_path))[0]
+    return "__".join(part for part in stem.replace("\\", "/").split("/") if part not in ("", "."))
+
+def begin(name):
+    if _sink is None:
+        return None
+    return _sink.begin(name)
+
+def close():
+    if _sink is not None:
+        _sink.close()
+
+# funciones de dibujo (se ejecutan en el hilo escritor sobre una copia)
+
+def draw_points(points, color=(0, 255, 0)):
+    def draw(img):
+        for (x, y) in np.asarray(points).astype(int):
+            cv2.circle(img, (int(x), int(y)), 5, color, -1)
+        return img
+    return draw
+
+def draw_contours(contours, color=(0, 255, 0)):
+    def draw(img):
+        cv2.drawContours(img, [np.asarray(c).astype(np.int32) for c in contours], -1, color, 2)
+        return img
+    return draw
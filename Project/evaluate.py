@@ -0,0 +1,328 @@
+# evaluate.py
+# evaluacion de precision y latencia contra la verdad de terreno: el nombre de cada imagen es su placa
+# (data/placas/BOT577.jpg -> BOT 577). Calcula la puntuacion 3/2/1 del README, el CER por caracter
+# y el tiempo por imagen, y puede comparar contra una evaluacion anterior (--baseline) para que
+# cada cambio de rendimiento se revise tambien en precision.
+# Con --fixture las respuestas OCR se reproducen desde un archivo (JSON o el CSV de resultados),
+# asi la corrida es deterministica y no necesita ollama.
+import os
+import re
+import csv
+import sys
+import json
+import time
+import argparse
+from ocr import OCREngine
+from ocr_clean import clean_ocr_text
+from ocr_cache import OCRCache
+from main import detect_plate, detect_bgr, make_engine
+from utils import preprocess_plate
+from frame_archive import FrameArchive
+from benchmark import summarize, git_commit
+from config import DEFAULT, load_config
+from ingest import iter_images
+
+# ReplayOCR: responde con las respuestas grabadas por nombre de archivo (key, que fija read_row antes de
+# cada lectura); si falta una y hay motor real, lo consulta y la agrega (asi se graba un fixture nuevo con
+# --record). Toma el lugar de ollama, asi con --ocr-engine local+ollama la cascada local corre de verdad
+# y solo las placas que escala se responden desde el fixture
+
+class ReplayOCR(OCREngine):
+    def __init__(self, responses=None, engine=None):
+        self.responses = dict(responses or {})
+        self.engine = engine
+        self.key = None
+        self.misses = 0
+
+    def warmup(self):
+        return self.engine.warmup() if self.engine is not None else True
+
+    def read_key(self, key, img):
+        if key in self.responses:
+            return self.responses[key]
+        self.misses += 1
+        if self.engine is None:
+            return None
+        result = self.engine.read(img)
+        self.responses[key] = result
+        return result
+
+    def read(self, img, prompt_user=None):
+        return self.read_key(self.key, img)
+
+# find_replay: el ReplayOCR dentro de una cascada o envoltura, o None
+
+def find_replay(engine):
+    if engine is None or isinstance(engine, ReplayOCR):
+        return engine
+    for attr in ("engine", "primary", "fallback"):
+        found = find_replay(getattr(engine, attr, None))
+        if found is not None:
+            return found
+    return None
+
+# load_fixture: JSON {archivo: respuesta} o CSV con columnas Archivo y OCR_bruto (p.ej. resultados.csv)
+
+def load_fixture(path):
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            # una respuesta por imagen: la de la primera candidata (Candidato "0"; vacio en CSV viejos)
+            return {row["Archivo"]: row["OCR_bruto"] for row in csv.DictReader(f)
+                    if row.get("Candidato") in (None, "", "0")}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_fixture(path, responses):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(responses.items())), f, indent=2, ensure_ascii=False)
+
+def label_from_filename(fname):
+    return os.path.splitext(fname)[0].upper()
+
+def normalize_plate(text):
+    return re.sub(r'[^A-Z0-9]', '', (text or "").upper())
+
+def edit_distance(a, b):
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+# score_plate: puntuacion del README
+#   3 -> placa y ciudad correctas, 2 -> placa parcial + ciudad, 1 -> solo ciudad
+# los nombres de archivo no traen la ciudad, asi que "ciudad correcta" = ciudad detectada (no vacia);
+# placa parcial = CER <= 0.5 (al menos la mitad de los caracteres)
+
+def score_plate(truth, plate, city):
+    pred = normalize_plate(plate)
+    cer = edit_distance(pred, truth) / len(truth) if truth else 0.0
+    exact = pred == truth
+    has_city = bool(re.search(r'[A-Z]', city or ""))
+    if has_city and exact:
+        points = 3
+    elif has_city and cer <= 0.5:
+        points = 2
+    elif has_city:
+        points = 1
+    else:
+        points = 0
+    return {"exact": exact, "cer": min(cer, 1.0), "city": has_city, "points": points}
+
+def list_images(folders, recursive=False):
+    for folder in folders:
+        for fname in iter_images(folder, recursive=recursive):
+            yield folder, fname
+
+# evaluate: corre deteccion + OCR en serie (para que el tiempo por imagen no dependa del paralelismo)
+# y devuelve el detalle por imagen y el resumen
+
+def evaluate(folders, engine, detect_width=None, color_lut=False, candidates=0, cfg=DEFAULT, decode_reduce=1,
+             recursive=False):
+    rows = []
+    for folder, fname in list_images(folders, recursive):
+        t0 = time.perf_counter()
+        plates, error = detect_plate(os.path.join(folder, fname), detect_width=detect_width,
+                                     color_lut=color_lut, candidates=candidates, cfg=cfg,
+                                     decode_reduce=decode_reduce)
+        rows.append(read_row(os.path.basename(os.path.normpath(folder)), fname, plates, error,
+                             time.perf_counter() - t0, engine))
+    return rows
+
+# evaluate_archive: lo mismo desde un archivo de frame_archive (vistas del memmap, sin decodificar);
+# con kind="warp" solo se preprocesa la primera candidata, asi que hsv, warp y compuerta quedan como
+# al empaquetar y lo que se barre es el preprocesado y el OCR
+
+def evaluate_archive(arc, engine, detect_width=None, color_lut=False, candidates=0, cfg=DEFAULT):
+    if arc.kind == "warp":
+        packed = arc.meta.get("config", {})
+        changed = [k for k in ("hsv", "warp", "gate") if packed.get(k) != cfg.to_dict()[k]]
+        if changed:
+            print(f"[EVAL] Aviso: {', '.join(changed)} de la configuracion no aplican a un archivo de warps")
+    rows = []
+    for entry, img in arc:
+        if entry["candidate"] > 0:
+            continue
+        t0 = time.perf_counter()
+        plates, error = None, str(entry["error"]) or None
+        if img is not None and arc.kind == "warp":
+            plate = preprocess_plate(img, params=cfg.preprocess, gray=True)
+            plates, error = ([plate], None) if plate is not None else (None, "preprocess")
+        elif img is not None:
+            plates, error = detect_bgr(img, detect_width=detect_width, color_lut=color_lut,
+                                       candidates=candidates, cfg=cfg)
+        rows.append(read_row(str(entry["folder"]), str(entry["name"]), plates, error,
+                             time.perf_counter() - t0, engine))
+    return rows
+
+# read_row: OCR de la primera placa y puntuacion de una imagen
+
+def read_row(folder, fname, plates, error, t_detect, engine):
+    truth = label_from_filename(os.path.basename(fname))
+    raw, t_ocr = None, 0.0
+    if error is None:
+        # se evalua la primera candidata (la de mayor puntaje), que es la que se reportaria
+        replay = find_replay(engine)
+        if replay is not None:
+            replay.key = fname
+        t0 = time.perf_counter()
+        raw = engine.read(plates[0])
+        t_ocr = time.perf_counter() - t0
+        if raw is None:
+            replay_only = replay is not None and replay.engine is None
+            error = "no_fixture" if replay_only and fname not in replay.responses else "ocr_none"
+
+    plate, city = clean_ocr_text(raw)
+    row = {"folder": folder, "file": fname, "truth": truth,
+           "raw": raw, "plate": plate, "city": city, "error": error,
+           "detect_s": t_detect, "ocr_s": t_ocr, "total_s": t_detect + t_ocr}
+    row.update(score_plate(truth, plate, city))
+    print(f"[EVAL] {fname}: {truth} -> {plate or '-'} | {city or '-'} | {row['points']} pts "
+          f"| CER {row['cer']:.2f} | {row['total_s'] * 1000:.0f} ms")
+    return row
+
+def summarize_rows(rows):
+    n = len(rows)
+    if not n:
+        return {"images": 0}
+    failures = {}
+    for r in rows:
+        if r["error"]:
+            failures[r["error"]] = failures.get(r["error"], 0) + 1
+    points = sum(r["points"] for r in rows)
+    return {
+        "images": n,
+        "exact": sum(r["exact"] for r in rows),
+        "accuracy": sum(r["exact"] for r in rows) / n,
+        "cer": sum(r["cer"] for r in rows) / n,
+        "points": points,
+        "max_points": 3 * n,
+        "score": points / (3 * n),
+        "distribution": {str(p): sum(r["points"] == p for r in rows) for p in (3, 2, 1, 0)},
+        "failures": failures,
+        "latency": {stage: summarize([r[stage] for r in rows]) for stage in ("detect_s", "ocr_s", "total_s")},
+    }
+
+def print_report(summary, by_folder):
+    for name, s in list(by_folder.items()) + [("total", summary)]:
+        if not s["images"]:
+            continue
+        lat = s["latency"]["total_s"]
+        print(f"[EVAL] {name:<20} {s['images']:>3} img | exactas {s['exact']:>3} ({s['accuracy']:.0%}) | "
+              f"CER {s['cer']:.3f} | puntos {s['points']}/{s['max_points']} ({s['score']:.0%}) | "
+              f"p50 {lat['p50_ms']:.0f} ms | p95 {lat['p95_ms']:.0f} ms")
+    print("[EVAL] Distribucion de puntos:", summary["distribution"], "| fallos:", summary["failures"])
+
+# compare_baseline: falla si la precision o la puntuacion bajan mas de `max_drop` respecto a la base
+
+def compare_baseline(summary, baseline_path, max_drop=0.0):
+    with open(baseline_path, encoding="utf-8") as f:
+        base = json.load(f)["summary"]
+    ok = True
+    for key in ("accuracy", "score"):
+        delta = summary[key] - base[key]
+        status = "OK"
+        if delta < -max_drop - 1e-9:
+            status = "REGRESION"
+            ok = False
+        print(f"[EVAL] {key}: {base[key]:.3f} -> {summary[key]:.3f} ({delta:+.3f}) {status}")
+    cer_delta = summary["cer"] - base["cer"]
+    if cer_delta > max_drop + 1e-9:
+        ok = False
+    print(f"[EVAL] cer: {base['cer']:.3f} -> {summary['cer']:.3f} ({cer_delta:+.3f}) "
+          f"{'OK' if cer_delta <= max_drop + 1e-9 else 'REGRESION'}")
+    p50_base = base["latency"]["total_s"]["p50_ms"]
+    p50 = summary["latency"]["total_s"]["p50_ms"]
+    print(f"[EVAL] latencia p50: {p50_base:.1f} ms -> {p50:.1f} ms ({p50 / p50_base if p50_base else 0:.2f}x)")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precision y latencia contra los nombres de archivo")
+    parser.add_argument("folders", nargs="*", default=["data/placas", "data/placasnodetectadas"])
+    parser.add_argument("--fixture", default=None,
+                        help="respuestas OCR grabadas (JSON o CSV con Archivo/OCR_bruto) para correr sin ollama")
+    parser.add_argument("--record", default=None,
+                        help="guardar las respuestas OCR de esta corrida como fixture JSON")
+    parser.add_argument("--ocr-engine", choices=["ollama", "local", "local+ollama"], default="ollama")
+    parser.add_argument("--templates", default="ocr_templates.npz")
+    parser.add_argument("--min-confidence", type=float, default=0.4)
+    parser.add_argument("--min-sharpness", type=float, default=100.0)
+    parser.add_argument("--min-contrast", type=float, default=80.0)
+    parser.add_argument("--plate-only", action="store_true",
+                        help="cascada local+ollama: no consultar ollama por la ciudad de las placas seguras")
+    parser.add_argument("--config", default=None, help="archivo TOML/YAML de configuracion del pipeline")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--cache", default=None, help="cache SQLite de OCR (por defecto sin cache)")
+    parser.add_argument("--detect-width", type=int, default=None)
+    parser.add_argument("--color-lut", action="store_true")
+    parser.add_argument("--candidates", type=int, default=0)
+    parser.add_argument("--decode-reduce", type=int, choices=[1, 2, 4, 8], default=1)
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--archive", default=None,
+                        help="leer de un archivo de frame_archive en vez de las carpetas (sin decodificar)")
+    parser.add_argument("--json", default="evaluacion.json", help="detalle y resumen en JSON")
+    parser.add_argument("--baseline", default=None, help="JSON de una evaluacion anterior para comparar")
+    parser.add_argument("--max-drop", type=float, default=0.0,
+                        help="caida maxima tolerada de precision/puntuacion frente a --baseline")
+    args = parser.parse_args()
+
+    if args.ocr_engine == "local" and args.record:
+        parser.error("--record graba respuestas de ollama; --ocr-engine local no las consulta")
+    if args.ocr_engine == "local" and args.fixture:
+        print("[EVAL] --ocr-engine local no consulta el fixture (solo responde por ollama)")
+
+    cfg = load_config(args.config) if args.config else DEFAULT
+    # el fixture responde en lugar de ollama; ollama real solo sin fixture o para grabar uno nuevo
+    live = None
+    if args.ocr_engine != "local" and (args.fixture is None or args.record):
+        cache = OCRCache(args.cache) if args.cache else None
+        live = make_engine("ollama", model=args.model or cfg.ocr.model, keep_alive=cfg.ocr.keep_alive,
+                           timeout=cfg.ocr.timeout, retries=cfg.ocr.retries, options=cfg.ocr.options(), cache=cache)
+    replay = ReplayOCR(load_fixture(args.fixture) if args.fixture else {}, engine=live)
+    engine = make_engine(args.ocr_engine, templates=args.templates, min_confidence=args.min_confidence,
+                         min_sharpness=args.min_sharpness, min_contrast=args.min_contrast,
+                         plate_only=args.plate_only, ollama=replay)
+    engine.warmup()
+
+    if args.archive:
+        rows = evaluate_archive(FrameArchive(args.archive), engine, detect_width=args.detect_width,
+                                color_lut=args.color_lut, candidates=args.candidates, cfg=cfg)
+    else:
+        rows = evaluate(args.folders, engine, detect_width=args.detect_width, color_lut=args.color_lut,
+                        candidates=args.candidates, cfg=cfg, decode_reduce=args.decode_reduce,
+                        recursive=args.recursive)
+    if args.fixture and replay.misses:
+        print(f"[EVAL] {replay.misses} imagenes sin respuesta en el fixture")
+    if hasattr(engine, "stats"):
+        print("[EVAL] Cascada:", engine.stats())
+    if args.record:
+        save_fixture(args.record, replay.responses)
+        print("[EVAL] Fixture guardado en", args.record)
+
+    summary = summarize_rows(rows)
+    by_folder = {}
+    for r in rows:
+        by_folder.setdefault(r["folder"], []).append(r)
+    by_folder = {name: summarize_rows(rs) for name, rs in by_folder.items()}
+    print_report(summary, by_folder)
+    if args.ocr_engine == "local" or (args.ocr_engine == "local+ollama" and args.plate_only):
+        # el OCR local no lee la ciudad y la puntuacion 3/2/1 la exige: se compara por exactas y CER
+        print("[EVAL] El OCR local no lee la ciudad: sus placas no suman puntos; comparar por exactas y CER")
+
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "folders": args.folders, "archive": args.archive, "fixture": args.fixture, "ocr_engine": args.ocr_engine,
+                     "detect_width": args.detect_width, "color_lut": args.color_lut,
+                     "candidates": args.candidates, "decode_reduce": args.decode_reduce,
+                     "config": cfg.to_dict()},
+            "summary": summary,
+            "by_folder": by_folder,
+            "images": rows,
+        }, f, indent=2, ensure_ascii=False)
+    print("[EVAL] Resultado guardado en", args.json)
+
+    if args.baseline and not compare_baseline(summary, args.baseline, args.max_drop):
+        sys.exit(1)
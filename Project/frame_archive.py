@@ -0,0 +1,230 @@
+# frame_archive.py
+# archivo binario de paso fijo para reprocesar sin decodificar: las imagenes (kind="frame") o los warps
+# de las placas detectadas (kind="warp", con caja y homografia de get_warp_from_box) se guardan en
+# ranuras de tamano fijo y se leen con np.memmap como vistas NumPy (sin copia). Un barrido de
+# preprocesado / OCR sobre un archivo de warps se salta la decodificacion JPEG y la deteccion.
+#   python frame_archive.py pack data/placas data/placasnodetectadas --out placas.arc
+#   python frame_archive.py info placas.arc
+#   python evaluate.py --archive placas.arc --config barrido.toml --ocr-engine local
+# formato: cabecera (HEADER) | ranuras desde DATA_OFFSET, cada una de `stride` bytes (h x w x c uint8,
+# la imagen arriba a la izquierda y el resto en cero) | indice (.npy, INDEX_DTYPE) | meta (JSON)
+import os
+import json
+import time
+import struct
+import argparse
+import cv2
+import numpy as np
+from config import DEFAULT, load_config
+from ingest import iter_images, read_image
+from main import find_warps
+
+MAGIC = b"ALPRARC1"
+KINDS = ("frame", "warp")
+# magic, tipo, alto, ancho y canales de la ranura, paso, ranuras, inicio del indice, inicio de la meta
+HEADER = struct.Struct("<8sB3xIIIQQQQ")
+DATA_OFFSET = 4096   # las ranuras empiezan alineadas a pagina
+
+# una fila por imagen y candidata; los fallos de deteccion quedan con slot = -1 y su motivo en error
+INDEX_DTYPE = np.dtype([
+    ("folder", "U64"), ("name", "U192"), ("candidate", "i2"), ("slot", "i8"),
+    ("h", "i4"), ("w", "i4"), ("scale", "f4"),
+    ("box", "f4", (4, 2)), ("M", "f4", (3, 3)), ("error", "U16"),
+])
+
+# ArchiveWriter: escritura secuencial (un write por ranura) a un archivo temporal que se renombra al
+# cerrar, asi un archivo a medias nunca queda con el nombre final
+
+class ArchiveWriter:
+    def __init__(self, path, kind="warp", shape=(240, 1200, 3), meta=None):
+        if kind not in KINDS:
+            raise ValueError(f"kind debe ser uno de {KINDS}, llego {kind!r}")
+        self.path = path
+        self.kind = kind
+        self.shape = tuple(shape)
+        h, w, c = self.shape
+        self.stride = -(-h * w * c // 64) * 64
+        self.meta = dict(meta or {})
+        self.entries = []
+        self.slots = 0
+        self._buf = np.zeros(self.stride, dtype=np.uint8)
+        self._tmp = path + ".tmp"
+        self._f = open(self._tmp, "wb")
+        self._f.write(b"\0" * DATA_OFFSET)
+
+    # add: guarda una imagen (la reduce si no cabe en la ranura) y devuelve el numero de ranura
+    def add(self, img, folder, name, candidate=0, box=None, M=None):
+        self._check(folder, name)
+        h, w, c = self.shape
+        if c == 1 and img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        scale = min(1.0, h / img.shape[0], w / img.shape[1])
+        if scale < 1.0:
+            size = (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale)))
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        ih, iw = img.shape[:2]
+        self._buf[:] = 0
+        self._buf[:h * w * c].reshape(h, w, c)[:ih, :iw] = img.reshape(ih, iw, c)
+        self._f.write(self._buf)
+        self.entries.append((folder, name, candidate, self.slots, ih, iw, scale,
+                             np.zeros((4, 2)) if box is None else box, np.eye(3) if M is None else M, ""))
+        self.slots += 1
+        return self.slots - 1
+
+    def fail(self, folder, name, error):
+        self._check(folder, name)
+        self.entries.append((folder, name, -1, -1, 0, 0, 0.0, np.zeros((4, 2)), np.eye(3), error))
+
+    # _check: el indice guarda carpeta y nombre en campos de largo fijo; uno mas largo se truncaria y
+    # las busquedas por nombre fallarian (o dos archivos quedarian con el mismo nombre)
+    def _check(self, folder, name):
+        for field, value in (("folder", folder), ("name", name)):
+            limit = INDEX_DTYPE[field].itemsize // 4
+            if len(value) > limit:
+                raise ValueError(f"{field} de mas de {limit} caracteres no cabe en el indice: {value!r}")
+
+    def close(self):
+        f = self._f
+        index_offset = f.tell()
+        np.save(f, np.array(self.entries, dtype=INDEX_DTYPE))
+        meta_offset = f.tell()
+        f.write(json.dumps(self.meta, ensure_ascii=False).encode("utf-8"))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, KINDS.index(self.kind), *self.shape, self.stride, self.slots,
+                            index_offset, meta_offset))
+        f.close()
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            os.remove(self._tmp)
+
+# FrameArchive: lectura; slots es un arreglo (ranuras, h, w, c) sobre el memmap, e image(i) la vista
+# del tamano real de la entrada i. Las vistas son de solo lectura y validas mientras viva el archivo
+
+class FrameArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, kind, h, w, c, stride, slots, index_offset, meta_offset = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path}: no es un archivo de frame_archive")
+            f.seek(index_offset)
+            self.index = np.load(f)
+            f.seek(meta_offset)
+            self.meta = json.loads(f.read().decode("utf-8"))
+        self.kind = KINDS[kind]
+        self.shape = (h, w, c)
+        if slots:
+            self._mm = np.memmap(path, dtype=np.uint8, mode="r", offset=DATA_OFFSET, shape=(slots * stride,))
+            self.slots = np.ndarray((slots, h, w, c), dtype=np.uint8, buffer=self._mm,
+                                    strides=(stride, w * c, c, 1))
+        else:
+            self._mm = None
+            self.slots = np.zeros((0, h, w, c), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    # image: vista (h, w, c) o (h, w) en gris de la entrada i; None si la entrada es un fallo
+    def image(self, i):
+        e = self.index[i]
+        if e["slot"] < 0:
+            return None
+        view = self.slots[e["slot"], :e["h"], :e["w"]]
+        return view[..., 0] if self.shape[2] == 1 else view
+
+    def __iter__(self):
+        for i in range(len(self.index)):
+            yield self.index[i], self.image(i)
+
+    def errors(self):
+        codes, counts = np.unique(self.index["error"][self.index["slot"] < 0], return_counts=True)
+        return {str(k): int(n) for k, n in zip(codes, counts)}
+
+# pack: empaqueta las imagenes de las carpetas; con kind="warp" corre la deteccion (find_warps) y guarda
+# los warps de cada candidata, con kind="frame" guarda la imagen decodificada
+
+def pack(out, folders, kind="warp", cfg=None, detect_width=None, color_lut=False, candidates=0,
+         decode_reduce=1, recursive=False, gray=False, slot_width=None, frame_size=(1280, 960)):
+    cfg = cfg or DEFAULT
+    if gray and kind == "frame":
+        # la deteccion (mascara HSV) necesita la imagen en color
+        raise ValueError("gray solo aplica a kind='warp'")
+    c = 1 if gray else 3
+    if kind == "warp":
+        # ancho maximo de un warp: max_aspect de la compuerta (4.5) mas el margen de expand_px
+        shape = (cfg.warp.target_h, slot_width or 5 * cfg.warp.target_h, c)
+    else:
+        shape = (frame_size[1], frame_size[0], c)
+    meta = {"kind": kind, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "folders": list(folders),
+            "detect_width": detect_width, "color_lut": color_lut, "candidates": candidates,
+            "decode_reduce": decode_reduce, "config": cfg.to_dict()}
+    images = 0
+    with ArchiveWriter(out, kind, shape, meta) as writer:
+        for folder in folders:
+            label = os.path.basename(os.path.normpath(folder))
+            for fname in iter_images(folder, recursive=recursive):
+                images += 1
+                bgr = read_image(os.path.join(folder, fname), decode_reduce)
+                if bgr is None:
+                    writer.fail(label, fname, "imread")
+                    continue
+                if kind == "frame":
+                    writer.add(bgr, label, fname)
+                    continue
+                found, error = find_warps(bgr, detect_width, color_lut, candidates, cfg)
+                if error is not None:
+                    writer.fail(label, fname, error)
+                    continue
+                for i, (box, M, warp) in enumerate(found):
+                    writer.add(warp, label, fname, candidate=i, box=box, M=M)
+        slots = writer.slots
+    return images, slots
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archivo de imagenes / warps de paso fijo para reprocesar")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_pack = sub.add_parser("pack", help="empaquetar carpetas")
+    p_pack.add_argument("folders", nargs="+")
+    p_pack.add_argument("--out", default="placas.arc")
+    p_pack.add_argument("--kind", choices=KINDS, default="warp",
+                        help="warp: placas detectadas (salta decodificacion y deteccion); frame: imagen completa")
+    p_pack.add_argument("--gray", action="store_true",
+                        help="guardar warps en gris (1 canal, 3 veces menos); el preprocesado empieza en gris")
+    p_pack.add_argument("--slot-width", type=int, default=None,
+                        help="ancho de la ranura de warps (por defecto 5 veces warp.target_h)")
+    p_pack.add_argument("--frame-size", default="1280x960",
+                        help="ranura de kind=frame (AnchoxAlto); las imagenes mas grandes se reducen")
+    p_pack.add_argument("--config", default=None)
+    p_pack.add_argument("--detect-width", type=int, default=None)
+    p_pack.add_argument("--color-lut", action="store_true")
+    p_pack.add_argument("--candidates", type=int, default=0)
+    p_pack.add_argument("--decode-reduce", type=int, choices=[1, 2, 4, 8], default=1)
+    p_pack.add_argument("--recursive", action="store_true")
+    p_info = sub.add_parser("info", help="resumen de un archivo")
+    p_info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.cmd == "pack" and args.gray and args.kind == "frame":
+        parser.error("--gray solo aplica a --kind warp (la deteccion necesita la imagen en color)")
+    if args.cmd == "pack":
+        width, height = (int(v) for v in args.frame_size.lower().split("x"))
+        cfg = load_config(args.config) if args.config else DEFAULT
+        start_time = time.time()
+        images, slots = pack(args.out, args.folders, args.kind, cfg, args.detect_width, args.color_lut,
+                             args.candidates, args.decode_reduce, args.recursive, args.gray, args.slot_width,
+                             (width, height))
+        print(f"[ARCHIVE] {images} imagenes -> {slots} ranuras en {args.out} "
+              f"({os.path.getsize(args.out) / 1e6:.1f} MB, {time.time() - start_time:.1f} s)")
+        args.path = args.out
+
+    arc = FrameArchive(args.path)
+    print(f"[ARCHIVE] {args.path}: kind={arc.kind} | ranura {arc.shape} | entradas {len(arc)} "
+          f"| ranuras {len(arc.slots)} | fallos {arc.errors()}")
@@ -0,0 +1,81 @@
+# ingest.py
+# ingesta de carpetas grandes: recorrido perezoso (recursivo opcional) y lectura a escala reducida
+# iter_images no arma la lista completa de archivos: produce las rutas en orden (alfabetico por carpeta)
+# a medida que recorre, y background() hace ese recorrido en un hilo con cola acotada para que la espera
+# de disco / red no frene al que envia trabajo al pool
+import os
+import cv2
+import queue
+import threading
+
+EXTS = (".jpg", ".jpeg", ".png")
+
+# lectores JPEG a escala reducida: el decodificador hace la reduccion (DCT escalada), sin leer
+# la imagen completa; en PNG OpenCV decodifica completo y reduce despues
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# iter_images: rutas relativas a `root` de las imagenes; con recursive=True entra a las subcarpetas
+# (despues de los archivos de cada carpeta). Sigue los enlaces simbolicos a carpetas, pero cada carpeta
+# real se recorre una sola vez (un enlace que apunta a una carpeta de arriba no hace un ciclo infinito)
+
+def iter_images(root, recursive=False, exts=EXTS):
+    stack = [""]
+    visited = {os.path.realpath(root)}
+    while stack:
+        rel = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, rel)) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print("[INGEST] ERROR: no se pudo leer la carpeta", os.path.join(root, rel), str(e))
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir():
+                real = os.path.realpath(entry.path) if recursive else None
+                if recursive and real not in visited:
+                    visited.add(real)
+                    subdirs.append(os.path.join(rel, entry.name))
+            elif entry.name.lower().endswith(exts):
+                yield os.path.join(rel, entry.name)
+        stack.extend(reversed(subdirs))
+
+# background: consume un iterable en un hilo aparte y lo entrega a traves de una cola acotada
+# si el iterable falla (carpeta borrada, permisos, red) la excepcion se relanza en el consumidor,
+# en vez de terminar la secuencia como si se hubiera recorrido completa
+
+def background(iterable, max_queue=256):
+    q = queue.Queue(maxsize=max_queue)
+    done = object()
+    failed = []
+
+    def produce():
+        try:
+            for item in iterable:
+                q.put(item)
+        except Exception as exc:
+            failed.append(exc)
+        finally:
+            q.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is done:
+            if failed:
+                raise failed[0]
+            return
+        yield item
+
+# read_image: cv2.imread con reduccion 1, 2, 4 u 8 (las coordenadas quedan en la escala reducida)
+
+def read_image(path, reduce=1):
+    flag = REDUCED_FLAGS.get(reduce)
+    if flag is None:
+        raise ValueError(f"reduce debe ser 1, 2, 4 u 8 (llego {reduce})")
+    return cv2.imread(path, flag)
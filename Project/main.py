@@ -1,71 +1,468 @@
-import cv2
 import os
-import numpy as np
+import argparse
 import time
 import csv
-from ocr import call_ollama
-from utils import create_mask, find_largest_contour, get_warp_from_box, preprocess_plate
-from ocr_clean import clean_ocr_text
-
-HMIN, HMAX = 17, 27
-SMIN, SMAX = 160, 255
-VMIN, VMAX = 190, 255
-
-def main(folder="data/placas", csv_out="resultados.csv"):
-    exts = (".jpg", ".jpeg", ".png")
-    files = [f for f in os.listdir(folder) if f.lower().endswith(exts)]
-    if not files:
-        print("[MAIN] No se encontraron imagenes en", folder)
+import debug
+import metrics
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from ocr import OllamaOCR, CascadeOCR, OCRBatcher
+from ocr_local import TemplateOCR
+from ocr_cache import OCRCache
+from utils import locate_plate, find_plate_candidates_box, get_warp_from_box, preprocess_plate, get_bgr_lut, gate_warp
+from ocr_clean import clean_ocr_text, PLATE_RE
+from config import ConfigStore, DEFAULT
+from ingest import iter_images, background, read_image
+from results_store import ResultsStore, CSV_HEADER, file_hash
+from calibration import HSVCalibrator, plate_histogram
+
+# motivos de fallo por imagen (codigo -> mensaje); el codigo se usa como etiqueta en las metricas
+FAILURES = {
+    "imread": "No se pudo leer la imagen",
+    "no_contour": "No se encontraron contornos",
+    "no_candidate": "Ningun contorno con forma de placa",
+    "empty_warp": "No se pudo generar warp",
+    "preprocess": "Preprocesado fallido",
+    "gate_area": "Contorno muy pequeno para ser placa",
+    "gate_fill": "Contorno con poco relleno de mascara",
+    "gate_aspect": "Contorno sin proporcion de placa",
+    "gate_edges": "Warp sin bordes de caracteres",
+    "gate_chars": "Warp sin caracteres suficientes",
+    "ocr_none": "OCR fallo",
+}
+
+# detect_plate: etapas CPU (mascara, contorno, warp, preprocesado) para una imagen
+# se ejecuta dentro del pool de procesos; devuelve ([placas_prepro], None) o (None, motivo)
+# la placa viaja en memoria hasta el OCR; prep_dir solo se usa si se quiere guardar en disco
+# detect_width: si se indica, la deteccion se hace sobre una copia reducida y el warp a resolucion completa
+# color_lut: mascara directa desde BGR con la tabla precalculada (se construye una vez por proceso)
+# candidates: si es > 0 se usan hasta N candidatos ordenados por puntaje en vez del contorno mas grande
+# cfg: Config con umbrales HSV, warp y preprocesado (None = valores por defecto)
+# decode_reduce: 2, 4 u 8 decodifica el JPEG ya reducido (deteccion y warp sobre esa escala); sirve para
+# camaras de alta resolucion donde la placa sigue ocupando bastantes pixeles
+# con el sumidero de depuracion activo (debug.configure) se guardan mascara, contorno, puntos, warp y
+# placa de las imagenes muestreadas, con el nombre de la imagen y el motivo si fallo
+# hists: lista opcional donde se agrega el histograma HSV del warp de cada placa (calibracion)
+# name: nombre de los artefactos de depuracion y de prep_dir (por defecto el del archivo); main lo arma
+# con la ruta relativa a la carpeta (debug.artifact_name) para que --recursive no repita nombres
+
+def detect_plate(path, prep_dir=None, detect_width=None, color_lut=False, candidates=0, cfg=None,
+                 decode_reduce=1, hists=None, name=None):
+    name = name or debug.artifact_name(os.path.basename(path))
+    dbg = debug.begin(name)
+    plates, error = _detect_plate(path, prep_dir, detect_width, color_lut, candidates, cfg or DEFAULT, dbg,
+                                  decode_reduce, hists, name)
+    if dbg is not None:
+        dbg.finish(error)
+    return plates, error
+
+def _detect_plate(path, prep_dir, detect_width, color_lut, candidates, cfg, dbg, decode_reduce=1, hists=None,
+                  name="placa"):
+    bgr = read_image(path, decode_reduce)
+    if bgr is None:
+        return None, "imread"
+    return detect_bgr(bgr, name, prep_dir, detect_width, color_lut, candidates, cfg, dbg, hists)
+
+# find_warps: mascara, contorno (o candidatos), warp y compuerta; devuelve ([(caja, M, warp)], None) o
+# (None, motivo). La caja y M estan en coordenadas de bgr (frame_archive guarda los warps con ellas)
+
+def find_warps(bgr, detect_width=None, color_lut=False, candidates=0, cfg=None, dbg=None):
+    cfg = cfg or DEFAULT
+    hsv = cfg.hsv.bounds()
+    lut = get_bgr_lut(*hsv) if color_lut else None
+    if candidates:
+        reasons = []
+        found = find_plate_candidates_box(bgr, *hsv, max_width=detect_width, lut=lut, max_candidates=candidates,
+                                          gate=cfg.gate, reasons=reasons, dbg=dbg)
+        if not found:
+            return None, reasons[0] if reasons else "no_candidate"
+        boxes = [box for score, cnt, box in found]
+    else:
+        cnt, box, reason = locate_plate(bgr, *hsv, max_width=detect_width, lut=lut, gate=cfg.gate, dbg=dbg)
+        if cnt is None:
+            return None, reason
+        boxes = [box]
+
+    # los warps que no pasan la compuerta no llegan al preprocesado ni al OCR
+    found, rejected = [], None
+    for box in boxes:
+        warp, M, size = get_warp_from_box(box, bgr, target_h=cfg.warp.target_h, min_w=cfg.warp.min_w,
+                                          expand_px=cfg.warp.expand_px, dbg=dbg)
+        if warp is None:
+            continue
+        reason = gate_warp(warp, cfg.gate) if cfg.gate.enabled else None
+        if reason is not None:
+            rejected = rejected or reason
+            continue
+        found.append((box, M, warp))
+    if not found:
+        return None, rejected or "empty_warp"
+    return found, None
+
+# detect_bgr: las mismas etapas sobre una imagen ya decodificada (la usa tambien el servicio HTTP);
+# name solo se usa para los archivos de prep_dir
+
+def detect_bgr(bgr, name="placa", prep_dir=None, detect_width=None, color_lut=False, candidates=0, cfg=None,
+               dbg=None, hists=None):
+    cfg = cfg or DEFAULT
+    found, error = find_warps(bgr, detect_width, color_lut, candidates, cfg, dbg)
+    if error is not None:
+        return None, error
+    warps = [warp for box, M, warp in found]
+
+    plates = []
+    for i, warp in enumerate(warps):
+        out_path = None
+        if prep_dir is not None:
+            suffix = f"_{i}" if i else ""
+            out_path = os.path.join(prep_dir, f"{name}_prep{suffix}.jpg")
+
+        plate = preprocess_plate(warp, out_path=out_path, params=cfg.preprocess, gray=True)
+        if dbg is not None:
+            dbg.add("warp", warp)
+            dbg.add("prep", plate)
+        if plate is not None:
+            plates.append(plate)
+            if hists is not None:
+                hists.append(plate_histogram(warp))
+    if not plates:
+        return None, "preprocess"
+
+    return plates, None
+
+# init_worker: inicializa cada proceso del pool (metricas y sumidero de depuracion del proceso principal)
+
+def init_worker(metrics_enabled=False, debug_opts=None):
+    metrics.enable(metrics_enabled)
+    if debug_opts is not None:
+        debug.configure(**debug_opts)
+
+# detect_plate_task: detect_plate + metricas del proceso hijo, que se devuelven para unirlas en el principal
+# con calibrate=True tambien devuelve los histogramas HSV de las placas (pocos KB, no el warp)
+
+def detect_plate_task(path, prep_dir=None, detect_width=None, color_lut=False, candidates=0, cfg=None,
+                      decode_reduce=1, calibrate=False, name=None):
+    hists = [] if calibrate else None
+    result = detect_plate(path, prep_dir, detect_width, color_lut, candidates, cfg, decode_reduce, hists, name)
+    return result, metrics.drain() if metrics.enabled() else None, hists
+
+# run_ocr: espera el resultado CPU de la imagen y hace la llamada OCR
+# se ejecuta en el pool de hilos, que limita las solicitudes simultaneas a ollama
+# todas las placas candidatas de la imagen van al OCR en un solo lote
+# calibrator: HSVCalibrator opcional; las placas leidas con formato valido alimentan la calibracion de
+# su camara y hora (when)
+
+def run_ocr(cpu_future, engine, calibrator=None, camera="default", when=None):
+    (plates, error), worker_metrics, hists = cpu_future.result()
+    metrics.merge(worker_metrics)
+    if error is not None:
+        return None, None, error
+
+    metrics.add_gauge("alpr_queue_depth", 1, queue="ocr_inflight")
+    start_time = time.time()
+    try:
+        ocr_results = engine.read_batch(plates)
+    finally:
+        metrics.add_gauge("alpr_queue_depth", -1, queue="ocr_inflight")
+    end_time = time.time()
+    elapsed = end_time - start_time
+
+    if all(r is None for r in ocr_results):
+        return None, elapsed, "ocr_none"
+    if calibrator is not None and hists:
+        for ocr_result, hist in zip(ocr_results, hists):
+            if ocr_result is not None and PLATE_RE.match(clean_ocr_text(ocr_result)[0]):
+                calibrator.observe(camera, hist, when)
+    return ocr_results, elapsed, None
+
+# make_engine: construye el motor OCR segun el nombre
+# "ollama" = VLM moondream, "local" = TemplateOCR en CPU, "local+ollama" = cascada: local y solo las
+# placas ambiguas (calidad baja, formato invalido o confianza baja) van a ollama
+
+def make_engine(kind="ollama", model="moondream", keep_alive="30m", timeout=120.0, retries=2, options=None,
+                cache=None, templates="ocr_templates.npz", min_confidence=0.4,
+                min_sharpness=100.0, min_contrast=80.0, batch_size=1, batch_mode="images", batch_wait=0.05,
+                batch_workers=1, pinned=(), ollama=None, plate_only=False):
+    if kind == "local":
+        return TemplateOCR(model_path=templates)
+    # ollama: motor que toma el lugar de OllamaOCR (p.ej. las respuestas grabadas de evaluate.py)
+    if ollama is None:
+        ollama = OllamaOCR(model=model, keep_alive=keep_alive, timeout=timeout, retries=retries, options=options,
+                           cache=cache, batch_size=batch_size, batch_mode=batch_mode, pinned=pinned)
+    if batch_size > 1:
+        # las placas de varios hilos se juntan en solicitudes de hasta batch_size placas
+        ollama = OCRBatcher(ollama, batch_size=batch_size, max_wait=batch_wait, workers=batch_workers)
+    if kind == "local+ollama":
+        return CascadeOCR(TemplateOCR(model_path=templates), ollama, min_confidence=min_confidence,
+                          min_sharpness=min_sharpness, min_contrast=min_contrast, plate_only=plate_only)
+    return ollama
+
+# pinned_fields: campos de OCRConfig que se dieron en la linea de comandos; tienen prioridad sobre
+# --config tambien cuando el archivo se recarga
+
+def pinned_fields(args):
+    flags = {"model": "model", "keep_alive": "keep_alive", "timeout": "ocr_timeout", "retries": "ocr_retries"}
+    return tuple(field for field, attr in flags.items() if getattr(args, attr, None) is not None)
+
+# configure_engine: aplica una OCRConfig recargada a los motores ollama dentro de envolturas y cascadas
+
+def configure_engine(engine, ocr_cfg):
+    if engine is None:
         return
+    if hasattr(engine, "configure"):
+        engine.configure(ocr_cfg)
+    for attr in ("engine", "primary", "fallback"):
+        configure_engine(getattr(engine, attr, None), ocr_cfg)
 
-    # abrir CSV en modo escritura (se sobreescribe cada vez)
-    with open(csv_out, mode="w", newline="", encoding="utf-8") as fcsv:
-        writer = csv.writer(fcsv)
-        writer.writerow(["Archivo", "OCR_bruto", "OCR_limpio", "Ciudad", "Tiempo_s"])
+# engine_timeout: tiempo maximo de una llamada al motor (el timeout de ollama dentro de envolturas y
+# cascadas); 0 si el motor es solo local
+
+def engine_timeout(engine):
+    if engine is None:
+        return 0.0
+    own = engine.timeout if isinstance(engine, OllamaOCR) else 0.0
+    return max([own] + [engine_timeout(getattr(engine, attr, None)) for attr in ("engine", "primary", "fallback")])
+
+# write_result: escribe las filas de una imagen en el CSV y, si hay almacen (results), las guarda
+# con el hash del archivo; ocr_future = None significa imagen ya procesada: se copian sus filas guardadas
 
-        for fname in files:
-            path = os.path.join(folder, fname)
-            print("\n[MAIN] Procesando:", path)
+def write_result(writer, folder, fname, ocr_future, results=None, digest=None):
+    path = os.path.join(folder, fname)
+    if ocr_future is None:
+        for raw, plate_fixed, city, elapsed, i in results.rows(os.path.normpath(path), digest):
+            writer.writerow([fname, raw, plate_fixed, city, f"{elapsed:.3f}", i])
+        return
+    print("\n[MAIN] Procesando:", path)
+
+    ocr_results, elapsed, error = ocr_future.result()
+    metrics.inc("alpr_images_total")
+    if error is not None:
+        metrics.inc("alpr_failures_total", reason=error)
+        print(f"[MAIN] [ERROR] {FAILURES[error]} en", path)
+        if results is not None:
+            results.put(os.path.normpath(path), digest, error=error)
+        return
 
-            bgr = cv2.imread(path)
-            if bgr is None:
-                print("[MAIN] [ERROR] No se pudo leer la imagen:", path)
-                continue
+    # una fila por placa candidata leida (Candidato = posicion en el ranking)
+    readings = []
+    for i, ocr_result in enumerate(ocr_results):
+        if ocr_result is None:
+            continue
+        plate_fixed, city = clean_ocr_text(ocr_result)
 
-            mask, kernel = create_mask(bgr, HMIN, HMAX, SMIN, SMAX, VMIN, VMAX)
-            cnt, box = find_largest_contour(mask, kernel)
-            if cnt is None:
-                print("[MAIN] [ERROR] No se encontraron contornos en", path)
-                continue
+        print(f"[RESULT] Archivo: {fname} | OCR bruto: {ocr_result} | OCR limpio: {plate_fixed}, {city} | Tiempo: {elapsed:.3f} s")
 
-            warp, M, size = get_warp_from_box(box, bgr, target_h=240, min_w=120)
-            if warp is None:
-                print("[MAIN] [ERROR] No se pudo generar warp en", path)
-                continue
+        # escribir fila en CSV
+        writer.writerow([fname, ocr_result, plate_fixed, city, f"{elapsed:.3f}", i])
+        readings.append((ocr_result, plate_fixed, city, elapsed, i))
+    if results is not None:
+        results.put(os.path.normpath(path), digest, readings)
 
-            name, ext = os.path.splitext(fname)
-            out_path = preprocess_plate(warp, out_path=f"data/placasprepro/{name}_prep.jpg")
-            if out_path is None:
-                print("[MAIN] [ERROR] Preprocesado fallido en", path)
-                continue
+# with_hash: agrega el hash del contenido a cada archivo (corre en el hilo del recorrido)
 
-            start_time = time.time()
-            ocr_result = call_ollama(out_path)
-            end_time = time.time()
-            elapsed = end_time - start_time
+def with_hash(folder, files):
+    for fname in files:
+        try:
+            yield fname, file_hash(os.path.join(folder, fname))
+        except OSError as e:
+            print("[MAIN] [ERROR] No se pudo leer", os.path.join(folder, fname), str(e))
 
-            if ocr_result is None:
-                print("[MAIN] [ERROR] OCR fallo en", path)
-                continue
+def main(folder="data/placas", csv_out="resultados.csv", workers=None, ocr_workers=1,
+         prep_dir=None, engine=None, detect_width=None, color_lut=False, candidates=0, ocr_batch=1,
+         store=None, debug_opts=None, recursive=False, decode_reduce=1, results=None, retry_failed=False,
+         reprocess=False, calibrator=None):
+    # recorrido perezoso en un hilo aparte: no se arma la lista completa (carpetas con decenas de miles
+    # de imagenes) y la lectura de imagenes ocurre en los procesos del pool
+    # results: ResultsStore; las imagenes con el mismo contenido ya procesadas no se vuelven a procesar
+    # calibrator: HSVCalibrator; la camara es la subcarpeta de la imagen y la hora la del archivo
+    files = iter_images(folder, recursive=recursive)
+    files = background(with_hash(folder, files) if results is not None else ((f, None) for f in files))
 
-            plate_fixed, city = clean_ocr_text(ocr_result)
+    # motor OCR unico: conexion reutilizada y modelo cargado antes de la primera placa
+    if engine is None:
+        engine = OllamaOCR()
+        engine.warmup()
+
+    workers = workers or os.cpu_count() or 1
+    # con lotes OCR cada solicitud a ollama lleva hasta ocr_batch placas: hacen falta ocr_batch hilos
+    # esperando por cada solicitud simultanea para llenar los lotes
+    ocr_threads = ocr_workers * max(1, ocr_batch)
+    # ventana de imagenes en vuelo: mantiene ocupados ambos pools sin cargar toda la carpeta
+    window = workers * 2 + ocr_threads
+
+    # abrir CSV en modo escritura (se sobreescribe cada vez; con almacen de resultados es una vista completa)
+    with open(csv_out, mode="w", newline="", encoding="utf-8") as fcsv, \
+         ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(metrics.enabled(), debug_opts)) as cpu_pool, \
+         ThreadPoolExecutor(max_workers=ocr_threads) as ocr_pool:
+        writer = csv.writer(fcsv)
+        writer.writerow(CSV_HEADER)
 
-            print(f"[RESULT] Archivo: {fname} | OCR bruto: {ocr_result} | OCR limpio: {plate_fixed}, {city} | Tiempo: {elapsed:.3f} s")
+        # las filas se escriben en el orden de los archivos, no en el de llegada
+        # store: ConfigStore; cada imagen usa la configuracion vigente al enviarla (recarga en caliente)
+        store = store or ConfigStore()
+        version = store.version
+        pending = deque()
+        count = skipped = 0
+        for fname, digest in files:
+            count += 1
+            if results is not None and not reprocess and \
+                    results.done(os.path.normpath(os.path.join(folder, fname)), digest, retry_failed):
+                # ya procesada: sus filas se copian al CSV en su turno
+                skipped += 1
+                pending.append((fname, None, results, digest))
+            else:
+                cfg = store.get()
+                if store.version != version:
+                    version = store.version
+                    configure_engine(engine, cfg.ocr)
+                path = os.path.join(folder, fname)
+                camera = when = None
+                if calibrator is not None:
+                    camera, when = os.path.dirname(fname) or "default", os.path.getmtime(path)
+                    cfg = calibrator.apply(cfg, camera, when)
+                cpu_future = cpu_pool.submit(detect_plate_task, path, prep_dir, detect_width, color_lut,
+                                             candidates, cfg, decode_reduce, calibrator is not None,
+                                             debug.artifact_name(fname))
+                pending.append((fname, ocr_pool.submit(run_ocr, cpu_future, engine, calibrator, camera, when),
+                                results, digest))
+            metrics.set_gauge("alpr_queue_depth", len(pending), queue="pending")
 
-            # escribir fila en CSV
-            writer.writerow([fname, ocr_result, plate_fixed, city, f"{elapsed:.3f}"])
+            if len(pending) >= window:
+                write_result(writer, folder, *pending.popleft())
 
+        while pending:
+            write_result(writer, folder, *pending.popleft())
+            metrics.set_gauge("alpr_queue_depth", len(pending), queue="pending")
+
+    if not count:
+        print("[MAIN] No se encontraron imagenes en", folder)
+        return
+    if results is not None:
+        print(f"[MAIN] Imagenes: {count} | ya procesadas (omitidas): {skipped} | procesadas: {count - skipped}")
+
+    if calibrator is not None:
+        calibrator.save()
+        for cam, bucket, n, hsv in calibrator.summary():
+            print(f"[MAIN] Calibracion HSV {cam}/{bucket}: {n:.0f} muestras | {hsv.bounds() if hsv else 'insuficientes'}")
+    if engine.cache is not None:
+        print("[MAIN] Cache OCR:", engine.cache.stats())
+    if isinstance(engine, CascadeOCR):
+        print("[MAIN] Cascada OCR:", engine.stats())
     print("\n[MAIN] Flujo completado para carpeta:", folder)
 
 if __name__ == "__main__":
-    main("data/placas")
+    parser = argparse.ArgumentParser(description="Deteccion y OCR de placas")
+    parser.add_argument("folder", nargs="?", default="data/placas")
+    parser.add_argument("--csv", default="resultados.csv")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="procesos para las etapas CPU (por defecto: num. de CPUs)")
+    parser.add_argument("--ocr-workers", type=int, default=1,
+                        help="solicitudes OCR simultaneas a ollama (ver OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--prep-dir", default=None,
+                        help="carpeta donde guardar las placas preprocesadas (opcional, ej. data/placasprepro)")
+    parser.add_argument("--recursive", action="store_true", help="incluir las subcarpetas")
+    parser.add_argument("--decode-reduce", type=int, choices=[1, 2, 4, 8], default=1,
+                        help="decodificar el JPEG reducido 1/N (deteccion y warp a esa escala)")
+    parser.add_argument("--detect-width", type=int, default=None,
+                        help="ancho maximo para la deteccion (piramide); el warp usa la imagen original")
+    parser.add_argument("--color-lut", action="store_true",
+                        help="mascara desde BGR con tabla precalculada (sin conversion HSV)")
+    parser.add_argument("--candidates", type=int, default=0,
+                        help="enviar a OCR hasta N placas candidatas por imagen (0 = solo el contorno mayor)")
+    parser.add_argument("--ocr-engine", choices=["ollama", "local", "local+ollama"], default="ollama",
+                        help="local = OCR por plantillas en CPU; local+ollama = local y ollama si la confianza es baja")
+    parser.add_argument("--templates", default="ocr_templates.npz",
+                        help="modelo del OCR local (se entrena con data/placas si no existe)")
+    parser.add_argument("--min-confidence", type=float, default=0.4,
+                        help="confianza minima del OCR local para no consultar ollama")
+    parser.add_argument("--min-sharpness", type=float, default=100.0,
+                        help="nitidez minima (varianza del laplaciano) para confiar en el OCR local")
+    parser.add_argument("--min-contrast", type=float, default=80.0,
+                        help="contraste minimo (percentil 95 - 5) para confiar en el OCR local")
+    parser.add_argument("--plate-only", action="store_true",
+                        help="cascada local+ollama: no consultar ollama por la ciudad de las placas seguras")
+    parser.add_argument("--ocr-batch", type=int, default=1,
+                        help="placas por solicitud a ollama (1 = una por solicitud)")
+    parser.add_argument("--ocr-batch-mode", choices=["images", "mosaic"], default="images",
+                        help="images = varias imagenes por mensaje; mosaic = placas apiladas en una imagen")
+    parser.add_argument("--ocr-batch-wait", type=float, default=0.05,
+                        help="espera maxima (s) para completar un lote")
+    parser.add_argument("--config", default=None,
+                        help="archivo TOML/YAML con umbrales, warp, preprocesado y OCR; se recarga si cambia")
+    parser.add_argument("--model", default=None, help="modelo de ollama (por defecto el de --config, moondream)")
+    parser.add_argument("--keep-alive", default=None,
+                        help="tiempo que ollama mantiene el modelo cargado (ej. 30m, -1m = siempre)")
+    parser.add_argument("--ocr-timeout", type=float, default=None,
+                        help="timeout por solicitud OCR en segundos")
+    parser.add_argument("--ocr-retries", type=int, default=None)
+    parser.add_argument("--cache", default="ocr_cache.db",
+                        help="base SQLite con resultados OCR ya calculados")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--cache-max-entries", type=int, default=10000)
+    parser.add_argument("--cache-max-age-days", type=float, default=30.0)
+    parser.add_argument("--store", default="resultados.db",
+                        help="almacen SQLite de resultados por ruta + hash; las imagenes ya procesadas se omiten")
+    parser.add_argument("--no-store", action="store_true", help="procesar todo sin almacen (comportamiento anterior)")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="reintentar tambien las imagenes donde no se detecto placa")
+    parser.add_argument("--reprocess", action="store_true",
+                        help="procesar todas las imagenes aunque esten en el almacen (p.ej. tras cambiar umbrales)")
+    parser.add_argument("--calibration", default=None,
+                        help="archivo .npz de calibracion HSV por camara (subcarpeta) y franja horaria; "
+                             "se usa, se actualiza con las placas leidas y se guarda")
+    parser.add_argument("--debug-dir", default=None,
+                        help="guardar mascara, contorno, puntos, warp y placa por imagen en esta carpeta")
+    parser.add_argument("--debug-sample", type=float, default=1.0,
+                        help="fraccion de imagenes con artefactos de depuracion (0..1)")
+    parser.add_argument("--debug-failures", action="store_true",
+                        help="guardar artefactos solo de las imagenes que fallan")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="exponer metricas Prometheus en este puerto (/metrics)")
+    parser.add_argument("--metrics-json", default=None,
+                        help="escribir snapshots JSON de metricas en este archivo")
+    parser.add_argument("--metrics-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.metrics_port is not None or args.metrics_json:
+        metrics.enable()
+    if args.metrics_port is not None:
+        metrics.serve_http(args.metrics_port)
+    if args.metrics_json:
+        metrics.start_json_writer(args.metrics_json, args.metrics_interval)
+
+    debug_opts = None
+    if args.debug_dir:
+        debug_opts = {"out_dir": args.debug_dir, "sample": args.debug_sample, "failures_only": args.debug_failures}
+
+    results = None if args.no_store else ResultsStore(args.store)
+    calibrator = HSVCalibrator(args.calibration) if args.calibration else None
+
+    cache = None
+    if not args.no_cache:
+        cache = OCRCache(args.cache, max_entries=args.cache_max_entries,
+                         max_age_s=args.cache_max_age_days * 24 * 3600)
+
+    store = ConfigStore(args.config)
+    ocr_cfg = store.get().ocr
+    engine = make_engine(args.ocr_engine, model=args.model or ocr_cfg.model,
+                         keep_alive=args.keep_alive or ocr_cfg.keep_alive,
+                         timeout=args.ocr_timeout if args.ocr_timeout is not None else ocr_cfg.timeout,
+                         retries=args.ocr_retries if args.ocr_retries is not None else ocr_cfg.retries,
+                         options=ocr_cfg.options(), cache=cache,
+                         templates=args.templates, min_confidence=args.min_confidence,
+                         min_sharpness=args.min_sharpness, min_contrast=args.min_contrast,
+                         plate_only=args.plate_only,
+                         batch_size=args.ocr_batch, batch_mode=args.ocr_batch_mode,
+                         batch_wait=args.ocr_batch_wait, batch_workers=args.ocr_workers,
+                         pinned=pinned_fields(args))
+    engine.warmup()
+
+    main(args.folder, csv_out=args.csv, workers=args.workers, ocr_workers=args.ocr_workers,
+         prep_dir=args.prep_dir, engine=engine, detect_width=args.detect_width, color_lut=args.color_lut,
+         candidates=args.candidates, ocr_batch=args.ocr_batch, store=store, debug_opts=debug_opts,
+         recursive=args.recursive, decode_reduce=args.decode_reduce, results=results,
+         retry_failed=args.retry_failed, reprocess=args.reprocess, calibrator=calibrator)
+
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
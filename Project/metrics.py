@@ -0,0 +1,172 @@
+# metrics.py
+# instrumentacion ligera del pipeline: tiempos por etapa, contadores (p.ej. motivos de fallo)
+# y gauges (profundidad de colas). Desactivado por defecto: cada llamada solo revisa una bandera.
+# Se exporta como texto Prometheus (/metrics) o como snapshot JSON periodico.
+import json
+import time
+import threading
+import functools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# limites (s) de los buckets del histograma de etapas; el OCR puede tardar decenas de segundos
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_enabled = False
+_lock = threading.Lock()
+_counters = {}  # (nombre, etiquetas) -> valor
+_gauges = {}    # (nombre, etiquetas) -> valor
+_timers = {}    # etapa -> [conteo, suma, buckets]
+
+def enable(flag=True):
+    global _enabled
+    _enabled = bool(flag)
+
+def enabled():
+    return _enabled
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(stage, seconds):
+    if not _enabled:
+        return
+    with _lock:
+        t = _timers.get(stage)
+        if t is None:
+            t = _timers[stage] = [0, 0.0, [0] * len(BUCKETS)]
+        t[0] += 1
+        t[1] += seconds
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                t[2][i] += 1
+
+def inc(name, amount=1, **labels):
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + amount
+
+def set_gauge(name, value, **labels):
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def add_gauge(name, delta, **labels):
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = _gauges.get(k, 0) + delta
+
+# timed: decorador que mide el tiempo de la funcion como etapa `stage`
+
+def timed(stage):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - t0)
+        return wrapper
+    return decorator
+
+# snapshot / drain / merge: permiten llevar las metricas de los procesos del pool al proceso principal
+
+def snapshot():
+    with _lock:
+        return {
+            "timestamp": time.time(),
+            "counters": [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, dict(labels), value] for (name, labels), value in _gauges.items()],
+            "timers": {stage: {"count": t[0], "sum": t[1], "buckets": list(t[2])} for stage, t in _timers.items()},
+        }
+
+def drain():
+    snap = snapshot()
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+    return snap
+
+def merge(snap):
+    if not _enabled or not snap:
+        return
+    with _lock:
+        for name, labels, value in snap["counters"]:
+            k = _key(name, labels)
+            _counters[k] = _counters.get(k, 0) + value
+        for stage, s in snap["timers"].items():
+            t = _timers.get(stage)
+            if t is None:
+                t = _timers[stage] = [0, 0.0, [0] * len(BUCKETS)]
+            t[0] += s["count"]
+            t[1] += s["sum"]
+            t[2] = [a + b for a, b in zip(t[2], s["buckets"])]
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        for (name, labels), value in sorted(_gauges.items()):
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        if _timers:
+            lines.append("# TYPE alpr_stage_seconds histogram")
+        for stage, (count, total, buckets) in sorted(_timers.items()):
+            for le, n in zip(BUCKETS, buckets):
+                lines.append(f'alpr_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {n}')
+            lines.append(f'alpr_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'alpr_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'alpr_stage_seconds_count{{stage="{stage}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/metrics", "/"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# serve_http: expone /metrics en formato Prometheus en un hilo aparte
+
+def serve_http(port, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[METRICS] Exponiendo metricas en http://{host}:{port}/metrics")
+    return server
+
+def write_json(path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=2)
+
+# start_json_writer: escribe un snapshot JSON cada `interval` segundos
+
+def start_json_writer(path, interval=10.0):
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            write_json(path)
+
+    threading.Thread(target=loop, daemon=True).start()
+    return stop
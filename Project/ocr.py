@@ -1,38 +1,448 @@
-import json
-from ollama import Client
-    
-def call_ollama(img_path, model="moondream", prompt_user=None):
-    #print("[FNC call_ollama] Preparando cliente ollama para:", img_path)
-    
-    if prompt_user is None:
-        prompt_user = ("Read the plate and the city name from the image. "
-                       "Return both separated by comma. An example of the result is: 'XYZ 123 , PASTO DC'")
-
-    try:
-        client = Client()
-        print("[FNC call_ollama] Cliente creado. Enviando solicitud...")
-        resp = client.chat(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are an OCR that reads car plates and city text below."},
-                {"role": "user", "content": prompt_user, "images": [img_path]}
-            ],
-            options={"temperature": 0.0, "num_predict": 16}
-        )
-    except Exception as e:
-        print("[FNC call_ollama] ERROR: fallo comunicacion con ollama:", str(e))
-        return None
-
-    try:
-        content = resp.get("message", {}).get("content", None)
-        if content:
-            #print("[FNC call_ollama] Respuesta recibida")
-            return content
+import re
+import time
+import queue
+import threading
+import cv2
+import numpy as np
+import metrics
+from concurrent.futures import Future
+from ocr_clean import PLATE_RE, clean_ocr_text
+
+try:
+    from ollama import Client
+except ImportError:  # motores locales (TemplateOCR) funcionan sin ollama
+    Client = None
+
+# encode_image: convierte la imagen a lo que espera ollama
+# ndarray -> bytes JPEG codificados una sola vez en memoria; bytes y rutas pasan tal cual
+
+def encode_image(img):
+    if isinstance(img, np.ndarray):
+        ok, buf = cv2.imencode(".jpg", img)
+        if not ok:
+            return None
+        return buf.tobytes()
+    if isinstance(img, (bytearray, memoryview)):
+        return bytes(img)
+    return img
+
+# OCREngine: interfaz comun de los motores OCR (ollama, local, mock)
+# read() devuelve el texto leido o None; read_scored() agrega una confianza 0..1 (None = desconocida)
+
+class OCREngine:
+    cache = None
+
+    def warmup(self):
+        return True
+
+    def read(self, img, prompt_user=None):
+        raise NotImplementedError
+
+    def read_scored(self, img):
+        return self.read(img), None
+
+    # read_batch: lee varias placas; devuelve una lista con el resultado (o None) de cada una
+    def read_batch(self, images, prompt_user=None):
+        return [self.read(img, prompt_user=prompt_user) for img in images]
+
+SYSTEM_PROMPT = "You are an OCR that reads car plates and city text below."
+USER_PROMPT = ("Read the plate and the city name from the image. "
+               "Return both separated by comma. An example of the result is: 'XYZ 123 , PASTO DC'")
+BATCH_PROMPT = ("There are {n} images, each one with a car plate. For each image, in order, read the plate and "
+                "the city name. Answer with exactly {n} lines, one per image, numbered like this: "
+                "'1: XYZ 123 , PASTO DC'")
+MOSAIC_PROMPT = ("The image shows {n} car plates stacked from top to bottom, each one with its number on the left. "
+                 "For each plate read the plate and the city name. Answer with exactly {n} lines, one per plate, "
+                 "numbered like this: '1: XYZ 123 , PASTO DC'")
+
+# parse_batch_response: separa la respuesta de una solicitud por lotes en una lectura por placa
+# acepta lineas numeradas ("2: ABC 123, CALI", "Plate 2 - ...") o, si no hay numeros, exactamente n lineas;
+# devuelve None si no se puede asignar una lectura a cada placa (se repite placa por placa)
+
+_BATCH_LINE_RE = re.compile(r'^\s*(?:plate|image|placa)?\s*#?(\d+)\s*[:.)\-]\s*(.*)$', re.IGNORECASE)
+
+def parse_batch_response(text, n):
+    lines = [ln.strip().strip("'\"") for ln in (text or "").splitlines() if ln.strip()]
+    numbered = {}
+    for ln in lines:
+        m = _BATCH_LINE_RE.match(ln)
+        if m and m.group(2).strip():
+            numbered.setdefault(int(m.group(1)), m.group(2).strip().strip("'\""))
+    if all(i in numbered for i in range(1, n + 1)):
+        return [numbered[i] for i in range(1, n + 1)]
+    if not numbered and len(lines) == n:
+        return lines
+    return None
+
+# tile_plates: mosaico vertical de placas (misma altura) con su numero a la izquierda,
+# para modelos que solo aceptan una imagen por solicitud
+
+def tile_plates(images, height=96, margin=56, gap=12):
+    rows = []
+    for img in images:
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        w = max(1, int(round(img.shape[1] * height / img.shape[0])))
+        rows.append(cv2.resize(img, (w, height), interpolation=cv2.INTER_AREA))
+    width = margin + max(r.shape[1] for r in rows)
+    mosaic = np.full((len(rows) * (height + gap) - gap, width, 3), 255, np.uint8)
+    for i, row in enumerate(rows):
+        y = i * (height + gap)
+        mosaic[y:y + height, margin:margin + row.shape[1]] = row
+        cv2.putText(mosaic, str(i + 1), (8, y + height // 2 + 14), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 3)
+    return mosaic
+
+# OllamaOCR: motor OCR de larga vida
+# mantiene un solo Client (conexion HTTP reutilizada), deja el modelo residente con keep_alive
+# y aplica timeout y reintentos por solicitud; con cache (OCRCache) las placas ya leidas no van a ollama
+
+class OllamaOCR(OCREngine):
+    def __init__(self, model="moondream", host=None, prompt_user=None,
+                 options=None, keep_alive="30m", timeout=120.0, retries=2, retry_delay=2.0,
+                 cache=None, batch_size=1, batch_mode="images", pinned=()):
+        self.model = model
+        self.prompt_user = prompt_user or USER_PROMPT
+        self.options = options or {"temperature": 0.0, "num_predict": 16}
+        self.keep_alive = keep_alive
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.cache = cache
+        # batch_size > 1: read_batch envia hasta batch_size placas por solicitud
+        # ("images" = varias imagenes en el mensaje, "mosaic" = una imagen con las placas apiladas)
+        self.batch_size = batch_size
+        self.batch_mode = batch_mode
+        # pinned: campos fijados en la linea de comandos (--model, --keep-alive, ...); la recarga no los cambia
+        self.pinned = frozenset(pinned)
+        if Client is None:
+            raise ImportError("OllamaOCR requiere el paquete ollama (pip install ollama)")
+        # el cliente es seguro entre hilos y reutiliza conexiones del pool
+        self.host = host
+        self.timeout = timeout
+        self.client = Client(host=host, timeout=timeout)
+
+    # configure: aplica una OCRConfig recargada (modelo, opciones, keep_alive, timeout, reintentos)
+    # sin reiniciar; la cache se indexa por modelo y opciones, asi que no mezcla resultados
+    def configure(self, cfg):
+        if "model" not in self.pinned:
+            if cfg.model != self.model:
+                print(f"[FNC OllamaOCR.configure] Modelo {self.model} -> {cfg.model}")
+            self.model = cfg.model
+        self.options = cfg.options()
+        if "keep_alive" not in self.pinned:
+            self.keep_alive = cfg.keep_alive
+        if "retries" not in self.pinned:
+            self.retries = cfg.retries
+        if "timeout" not in self.pinned and cfg.timeout != self.timeout:
+            self.timeout = cfg.timeout
+            self.client = Client(host=self.host, timeout=cfg.timeout)
+
+    # warmup: carga el modelo en memoria antes de la primera placa (prompt vacio)
+    def warmup(self):
+        print(f"[FNC OllamaOCR.warmup] Cargando modelo {self.model} (keep_alive={self.keep_alive})")
+        start_time = time.time()
+        try:
+            self.client.generate(model=self.model, prompt="", keep_alive=self.keep_alive)
+        except Exception as e:
+            print("[FNC OllamaOCR.warmup] ERROR: fallo comunicacion con ollama:", str(e))
+            return False
+        print(f"[FNC OllamaOCR.warmup] Modelo listo en {time.time() - start_time:.3f} s")
+        return True
+
+    def _cache_get(self, img, prompt_user):
+        if self.cache is None:
+            return None, None
+        key = self.cache.make_key(img, self.model, prompt_user, self.options)
+        cached = self.cache.get(key)
+        metrics.inc("alpr_ocr_cache_total", result="hit" if cached is not None else "miss")
+        return key, cached
+
+    @metrics.timed("ocr")
+    def read(self, img, prompt_user=None):
+        # img: ndarray BGR/gris, bytes de imagen codificada o ruta a archivo
+        prompt_user = prompt_user or self.prompt_user
+        key, cached = self._cache_get(img, prompt_user)
+        if cached is not None:
+            return cached
+
+        content = self._request(img, prompt_user)
+        if content is not None and key is not None:
+            self.cache.put(key, content)
+        return content
+
+    # read_batch: con batch_size > 1 agrupa las placas que no estan en cache en solicitudes de hasta
+    # batch_size placas; si la respuesta no se puede separar por placa, ese grupo se repite una a una.
+    # La cache se indexa con el prompt individual, asi que comparte entradas con read()
+    @metrics.timed("ocr_batch")
+    def read_batch(self, images, prompt_user=None):
+        if self.batch_size <= 1 or len(images) <= 1:
+            return super().read_batch(images, prompt_user=prompt_user)
+        prompt_user = prompt_user or self.prompt_user
+
+        results = [None] * len(images)
+        keys = [None] * len(images)
+        todo = []
+        for i, img in enumerate(images):
+            keys[i], results[i] = self._cache_get(img, prompt_user)
+            if results[i] is None:
+                todo.append(i)
+
+        for start in range(0, len(todo), self.batch_size):
+            group = todo[start:start + self.batch_size]
+            texts = self._request_batch([images[i] for i in group]) if len(group) > 1 else None
+            if len(group) > 1:
+                metrics.inc("alpr_ocr_batch_total", result="ok" if texts is not None else "fallback")
+            if texts is None:
+                texts = [self._request(images[i], prompt_user) for i in group]
+            for i, text in zip(group, texts):
+                results[i] = text
+                if text is not None and keys[i] is not None:
+                    self.cache.put(keys[i], text)
+        return results
+
+    def _request(self, img, prompt_user):
+        image = encode_image(img)
+        if image is None:
+            print("[FNC OllamaOCR._request] ERROR: no se pudo codificar la imagen")
+            metrics.inc("alpr_ocr_errors_total", kind="encode")
+            return None
+        return self._chat(prompt_user, [image], self.options)
+
+    def _request_batch(self, images):
+        n = len(images)
+        if self.batch_mode == "mosaic":
+            encoded = [encode_image(tile_plates(images))]
+            prompt = MOSAIC_PROMPT.format(n=n)
         else:
-            print("[FNC call_ollama] ERROR: respuesta sin contenido util. Respuesta cruda:")
-            print(json.dumps(resp, indent=2))
+            encoded = [encode_image(img) for img in images]
+            prompt = BATCH_PROMPT.format(n=n)
+        if any(image is None for image in encoded):
+            metrics.inc("alpr_ocr_errors_total", kind="encode")
+            return None
+
+        # la respuesta crece con el numero de placas
+        options = dict(self.options)
+        if "num_predict" in options:
+            options["num_predict"] = options["num_predict"] * n + 4 * n
+        content = self._chat(prompt, encoded, options)
+        if content is None:
             return None
-    except Exception as e:
-        print("[FNC call_ollama] ERROR procesando la respuesta:", str(e))
-        print("Respuesta cruda:", resp)
-        return None
+        texts = parse_batch_response(content, n)
+        if texts is None:
+            print(f"[FNC OllamaOCR._request_batch] Respuesta no separable en {n} placas, se repite una a una:",
+                  repr(content))
+            metrics.inc("alpr_ocr_errors_total", kind="batch_parse")
+        return texts
+
+    def _chat(self, prompt_user, images, options):
+        resp = None
+        for attempt in range(self.retries + 1):
+            try:
+                resp = self.client.chat(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt_user, "images": images}
+                    ],
+                    options=options,
+                    keep_alive=self.keep_alive
+                )
+                break
+            except Exception as e:
+                print(f"[FNC OllamaOCR._chat] ERROR: fallo comunicacion con ollama (intento {attempt + 1}):", str(e))
+                metrics.inc("alpr_ocr_errors_total", kind="request")
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay * (attempt + 1))
+        if resp is None:
+            return None
+
+        try:
+            content = resp.get("message", {}).get("content", None)
+            if content:
+                #print("[FNC OllamaOCR._chat] Respuesta recibida")
+                return content
+            else:
+                print("[FNC OllamaOCR._chat] ERROR: respuesta sin contenido util. Respuesta cruda:")
+                metrics.inc("alpr_ocr_errors_total", kind="empty")
+                print(resp)
+                return None
+        except Exception as e:
+            print("[FNC OllamaOCR._chat] ERROR procesando la respuesta:", str(e))
+            metrics.inc("alpr_ocr_errors_total", kind="parse")
+            print("Respuesta cruda:", resp)
+            return None
+
+# OCRBatcher: junta las placas que llegan de varios hilos (read / read_batch) y las entrega al motor
+# en lotes de hasta batch_size, esperando como maximo max_wait segundos a que se llene el lote;
+# workers = solicitudes por lotes simultaneas al motor
+
+class OCRBatcher(OCREngine):
+    def __init__(self, engine, batch_size=4, max_wait=0.05, workers=1):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        for _ in range(workers):
+            threading.Thread(target=self._loop, daemon=True).start()
+
+    @property
+    def cache(self):
+        return self.engine.cache
+
+    def warmup(self):
+        return self.engine.warmup()
+
+    def read(self, img, prompt_user=None):
+        return self.read_batch([img], prompt_user=prompt_user)[0]
+
+    def read_batch(self, images, prompt_user=None):
+        futures = []
+        for img in images:
+            future = Future()
+            self._queue.put((img, prompt_user, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            metrics.inc("alpr_ocr_batched_total", len(batch))
+
+            # un lote por prompt (normalmente todos usan el prompt por defecto)
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for prompt_user, items in groups.items():
+                try:
+                    results = self.engine.read_batch([img for img, _, _ in items], prompt_user=prompt_user)
+                except Exception as e:
+                    for _, _, future in items:
+                        future.set_exception(e)
+                    continue
+                for (_, _, future), result in zip(items, results):
+                    future.set_result(result)
+
+# motores compartidos por modelo para call_ollama
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(model="moondream"):
+    with _engines_lock:
+        if model not in _engines:
+            _engines[model] = OllamaOCR(model=model)
+        return _engines[model]
+
+# call_ollama: interfaz simple; reutiliza el motor del modelo en vez de crear un Client por llamada
+
+def call_ollama(img, model="moondream", prompt_user=None):
+    return get_engine(model).read(img, prompt_user=prompt_user)
+
+# MockOCR: motor falso con la misma interfaz que OllamaOCR (read / warmup)
+# devuelve un texto fijo tras una latencia configurable; sirve para benchmarks y pruebas sin ollama
+
+class MockOCR(OCREngine):
+    def __init__(self, latency=0.0, jitter=0.0, response="XYZ 123 , PASTO DC", seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.response = response
+        self.cache = None
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def read(self, img, prompt_user=None):
+        delay = self.latency
+        if self.jitter:
+            with self._lock:
+                delay += float(self._rng.uniform(-self.jitter, self.jitter))
+        if delay > 0:
+            time.sleep(delay)
+        return self.response
+
+# plate_quality: calidad de la placa preprocesada (sin OCR)
+# nitidez = varianza del laplaciano, contraste = rango entre percentiles 5 y 95 del gris
+
+def plate_quality(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    lo, hi = np.percentile(gray, [5, 95])
+    return {"sharpness": sharpness, "contrast": float(hi - lo)}
+
+# CascadeOCR: cascada de motores. Las placas pasan primero por el motor rapido (primary) y solo las
+# ambiguas van al lento (fallback). Una placa es "segura" si tiene nitidez y contraste suficientes
+# y la lectura rapida cumple el formato AAA 999 con confianza >= min_confidence.
+# El motor rapido (TemplateOCR) no lee la ciudad: con plate_only=False la ciudad de una placa segura
+# se toma de la lectura del lento ("AAA 999 , CIUDAD" con la placa del rapido); con plate_only=True
+# la placa segura no va al lento y la respuesta queda sin ciudad.
+# Cuenta las placas por camino (city = segura que fue al lento solo por la ciudad) y los motivos
+# de escalamiento.
+
+class CascadeOCR(OCREngine):
+    def __init__(self, primary, fallback, min_confidence=0.4, min_sharpness=100.0, min_contrast=80.0,
+                 plate_only=False):
+        self.primary = primary
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+        self.min_sharpness = min_sharpness
+        self.min_contrast = min_contrast
+        self.plate_only = plate_only
+        self.cache = getattr(fallback, "cache", None)
+        self.counts = {"primary": 0, "city": 0, "fallback": 0}
+        self.reasons = {}
+        self._lock = threading.Lock()
+
+    def warmup(self):
+        return self.primary.warmup() and self.fallback.warmup()
+
+    # escalate: motivo para enviar la placa al motor lento, o None si la lectura rapida es segura
+    def escalate(self, img):
+        quality = plate_quality(img)
+        if quality["sharpness"] < self.min_sharpness:
+            return "sharpness", None
+        if quality["contrast"] < self.min_contrast:
+            return "contrast", None
+
+        text, conf = self.primary.read_scored(img)
+        if text is None:
+            return "no_read", None
+        if not PLATE_RE.match(text):
+            return "syntax", None
+        if conf is None or conf < self.min_confidence:
+            return "confidence", None
+        return None, (text, conf)
+
+    def read_scored(self, img):
+        reason, result = self.escalate(img)
+        if reason is None and self.plate_only:
+            path = "primary"
+        elif reason is None:
+            path = "city"
+            text, conf = result
+            city = clean_ocr_text(self.fallback.read_scored(img)[0])[1]
+            result = (f"{text} , {city}" if city else text, conf)
+        else:
+            result = self.fallback.read_scored(img)
+            path = "fallback"
+
+        with self._lock:
+            self.counts[path] += 1
+            if reason is not None:
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        metrics.inc("alpr_ocr_path_total", path=path)
+        if reason is not None:
+            metrics.inc("alpr_ocr_escalations_total", reason=reason)
+        return result
+
+    def read(self, img, prompt_user=None):
+        return self.read_scored(img)[0]
+
+    def stats(self):
+        with self._lock:
+            return {"paths": dict(self.counts), "escalations": dict(self.reasons)}
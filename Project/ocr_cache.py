@@ -0,0 +1,104 @@
+# ocr_cache.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+# OCRCache: cache en disco (SQLite) de resultados OCR
+# la clave es un hash del contenido de la placa preprocesada + modelo, prompt y opciones,
+# asi que la misma placa (re-ejecuciones, cuadros repetidos de un carro parqueado) no vuelve a ollama
+
+class OCRCache:
+    def __init__(self, path="ocr_cache.db", max_entries=10000, max_age_s=30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_s = max_age_s
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # una conexion compartida entre los hilos OCR, protegida con el lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr ("
+            " key TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr(last_used)")
+        self._conn.commit()
+        self.evict()
+
+    # make_key: hash de los pixeles (con forma y tipo) o de los bytes de la imagen
+    @staticmethod
+    def make_key(img, model, prompt, options):
+        h = hashlib.sha256()
+        if isinstance(img, np.ndarray):
+            h.update(str((img.shape, img.dtype.str)).encode())
+            h.update(np.ascontiguousarray(img).data)
+        elif isinstance(img, (bytes, bytearray, memoryview)):
+            h.update(img)
+        else:
+            with open(img, "rb") as f:
+                h.update(f.read())
+        h.update(model.encode())
+        h.update(prompt.encode())
+        h.update(json.dumps(options, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT result, created FROM ocr WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or (self.max_age_s and now - row[1] > self.max_age_s):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE ocr SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, result):
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr (key, result, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, result, now, now)
+            )
+            self._conn.commit()
+        self.evict()
+
+    # evict: borra entradas vencidas por edad y las menos usadas si se supera max_entries
+    def evict(self):
+        with self._lock:
+            if self.max_age_s:
+                self._conn.execute("DELETE FROM ocr WHERE created < ?", (time.time() - self.max_age_s,))
+            if self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM ocr WHERE key IN ("
+                    " SELECT key FROM ocr ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM ocr").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,36 +1,216 @@
 # ocr_clean.py
+# normalizacion de la respuesta OCR: placa (AAA 999) y ciudad
+# - patrones compilados una sola vez
+# - la placa se arma por tokens (X,Y,Z 123 / G-F-N-929 / ids = 'CSC-311') y se corrige por posicion:
+#   en las 3 primeras posiciones van letras y en las 3 ultimas digitos (O<->0, I<->1, B<->8, ...)
+# - la ciudad se busca en un indice fijo de municipios con un BK-tree (distancia de edicion)
+# - clean_ocr_batch normaliza columnas completas (respuestas repetidas se calculan una vez)
 import re
+import csv
+import argparse
+import unicodedata
+from functools import lru_cache
 
-def clean_ocr_text(raw):
-    if not raw or not isinstance(raw, str):
-        return '', ''
+# formato de placa de carro: tres letras y tres digitos (AAA 999)
+PLATE_RE = re.compile(r'^[A-Z]{3} ?[0-9]{3}$')
+
+_KEY_RE = re.compile(r'\b[A-Z]+\s*=\s*')        # "ids = ", "city = " que agrega el modelo
+_TOKEN_RE = re.compile(r'[A-Z0-9]+')
+
+# confusiones tipicas del OCR segun la posicion
+TO_LETTER = {"0": "O", "1": "I", "8": "B", "5": "S", "2": "Z", "6": "G"}
+TO_DIGIT = {"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "B": "8", "S": "5", "Z": "2", "G": "6"}
+
+# municipios frecuentes en placas (oficinas de transito); se puede reemplazar con load_municipalities
+MUNICIPALITIES = [
+    "BOGOTA DC", "MEDELLIN", "CALI", "BARRANQUILLA", "CARTAGENA", "BUCARAMANGA", "CUCUTA", "PEREIRA",
+    "MANIZALES", "ARMENIA", "IBAGUE", "NEIVA", "PASTO", "POPAYAN", "MONTERIA", "SINCELEJO", "VALLEDUPAR",
+    "SANTA MARTA", "RIOHACHA", "TUNJA", "VILLAVICENCIO", "YOPAL", "FLORENCIA", "QUIBDO", "MOCOA",
+    "ARAUCA", "LETICIA", "SAN ANDRES", "INIRIDA", "MITU", "PUERTO CARRENO", "SAN JOSE DEL GUAVIARE",
+    "CHIA", "CAJICA", "COTA", "FUNZA", "MOSQUERA", "MADRID", "FACATATIVA", "ZIPAQUIRA", "SOACHA",
+    "LA CALERA", "TOCANCIPA", "SOPO", "TENJO", "TABIO", "SIBATE", "GIRARDOT", "FUSAGASUGA", "CHOCONTA",
+    "UBATE", "VILLETA", "LA MESA", "ENVIGADO", "ITAGUI", "BELLO", "SABANETA", "RIONEGRO", "LA ESTRELLA",
+    "CALDAS", "COPACABANA", "GIRARDOTA", "MARINILLA", "PALMIRA", "BUGA", "TULUA", "CARTAGO", "YUMBO",
+    "JAMUNDI", "CANDELARIA", "DOSQUEBRADAS", "SANTA ROSA DE CABAL", "FLORIDABLANCA", "GIRON",
+    "PIEDECUESTA", "BARRANCABERMEJA", "SAN GIL", "SOLEDAD", "MALAMBO", "SABANALARGA", "PUERTO COLOMBIA",
+    "TURBACO", "ARJONA", "MAGANGUE", "DUITAMA", "SOGAMOSO", "CHIQUINQUIRA", "PAIPA", "AGUAZUL",
+    "RESTREPO", "ACACIAS", "GRANADA", "ESPINAL", "MELGAR", "HONDA", "PITALITO", "GARZON", "IPIALES",
+    "TUMACO", "CERETE", "SAHAGUN", "LORICA", "CIENAGA", "FUNDACION", "AGUACHICA", "OCANA", "PAMPLONA",
+    "VILLA DEL ROSARIO", "LOS PATIOS", "CALARCA", "LA DORADA", "CHINCHINA", "APARTADO", "TURBO",
+    "CAUCASIA", "MAICAO", "COROZAL", "SANTANDER DE QUILICHAO",
+]
+
+def strip_accents(text):
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+def edit_distance(a, b):
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+# BKTree: busqueda de la palabra mas cercana por distancia de edicion sin recorrer todo el indice
+
+class BKTree:
+    def __init__(self, words=()):
+        self.root = None
+        self.words = set()
+        for w in words:
+            self.add(w)
+
+    def add(self, word):
+        self.words.add(word)
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            d = edit_distance(word, node[0])
+            if d == 0:
+                return
+            if d not in node[1]:
+                node[1][d] = (word, {})
+                return
+            node = node[1][d]
+
+    # nearest: (palabra, distancia) mas cercana con distancia <= max_dist, o (None, None)
+    def nearest(self, word, max_dist):
+        if word in self.words:
+            return word, 0
+        best, best_d = None, max_dist + 1
+        stack = [self.root] if self.root else []
+        while stack:
+            w, children = stack.pop()
+            d = edit_distance(word, w)
+            if d < best_d:
+                best, best_d = w, d
+            for k, child in children.items():
+                if d - best_d < k < d + best_d:
+                    stack.append(child)
+        return (best, best_d) if best is not None else (None, None)
+
+_index = BKTree(MUNICIPALITIES)
 
-    s = raw.strip().upper()
-    s = re.sub(r'[^A-Z0-9 ,]', '', s)
+def load_municipalities(path):
+    global _index
+    with open(path, encoding="utf-8") as f:
+        names = [strip_accents(line.strip().upper()) for line in f if line.strip()]
+    _index = BKTree(names)
+    match_city.cache_clear()
+    _clean.cache_clear()
+    return len(names)
 
-    # separar por coma primero
-    parts = [p.strip() for p in s.split(',') if p.strip()]
-    plate_part = parts[0] if parts else s
-    rest_text = ', '.join(parts[1:]) if len(parts) > 1 else ''
+# match_city: municipio del indice mas parecido al texto; prueba el texto completo y sus prefijos de
+# palabras, del mas largo al mas corto, y devuelve solo el nombre del indice (las palabras que siguen
+# son ruido del OCR o del modelo: MONTERIA MONTERIA -> MONTERIA, CALI VALLE -> CALI,
+# SANTANA MARTIA P -> SANTA MARTA); sin coincidencia devuelve el texto tal cual
 
-    # buscar letras y numeros
-    letters = re.findall(r'[A-Z]', plate_part)
-    digits = re.findall(r'[0-9]', plate_part)
+@lru_cache(maxsize=4096)
+def match_city(text):
+    words = text.split()
+    for n in range(len(words), 0, -1):
+        candidate = " ".join(words[:n])
+        if len(candidate) < 3:
+            break
+        name, d = _index.nearest(candidate, max(1, len(candidate) // 4))
+        if name is not None:
+            return name
+    return text
 
-    letters = letters[:3]
-    digits = digits[:3]
+# fix_plate: aplica las confusiones segun la posicion (letras 0-2, digitos 3-5)
+# cada bloque necesita al menos un caracter real de su tipo: con el bloque de letras todo en digitos
+# (o al reves) las sustituciones inventarian una placa valida ('155501' -> ISS 501); devuelve None
+
+def fix_plate(chars):
+    if len(chars) != 6 or not any(c.isalpha() for c in chars[:3]) or not any(c.isdigit() for c in chars[3:]):
+        return None
+    letters = "".join(TO_LETTER.get(c, c) for c in chars[:3])
+    digits = "".join(TO_DIGIT.get(c, c) for c in chars[3:6])
+    return letters, digits
+
+# split_plate: separa los tokens de la placa de los de la ciudad
+# junta tokens cortos hasta tener 6 caracteres terminados en digito; una palabra de letras despues
+# de los numeros ya es la ciudad; los digitos sobrantes pegados a la placa se descartan
+
+def split_plate(tokens):
+    buf, used = "", 0
+    for tok in tokens:
+        digits = sum(c.isdigit() for c in buf)
+        if tok.isalpha() and ((digits and len(tok) >= 3) or digits >= 3):
+            break
+        if not buf and tok.isalpha() and len(tok) > 4:
+            break
+        buf += tok
+        used += 1
+        if len(buf) >= 6 and tok[-1].isdigit():
+            break
+    rest = tokens[used:]
+    while rest and rest[0].isdigit():
+        rest = rest[1:]
+    return buf, rest
+
+def _plate_chars(buf):
+    # con mas de 6 caracteres: 3 letras del inicio y los 3 caracteres que siguen a las letras
+    lead = len(buf) - len(buf.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    if len(buf) > 6 and lead >= 3:
+        return buf[:3] + buf[lead:lead + 3]
+    return buf[:6]
+
+@lru_cache(maxsize=4096)
+def _clean(raw):
+    s = strip_accents(raw).upper()
+    s = _KEY_RE.sub(" ", s)
+    tokens = _TOKEN_RE.findall(s)
+    if not tokens:
+        return '', ''
+
+    buf, rest = split_plate(tokens)
+    if not any(c.isdigit() for c in buf):
+        # sin digitos no hay placa: es solo la ciudad ('CALI')
+        return '', match_city(" ".join(tokens))
+    city = match_city(" ".join(rest)) if rest else ''
+    if len(buf) >= 6:
+        fixed = fix_plate(_plate_chars(buf))
+        if fixed is not None and PLATE_RE.match(f"{fixed[0]} {fixed[1]}"):
+            return f"{fixed[0]} {fixed[1]}", city
+
+    # sin placa valida: se deja lo leido (incompleto) sin corregir ni separar, y la ciudad encontrada
+    return buf, city
+
+def clean_ocr_text(raw):
+    if not raw or not isinstance(raw, str):
+        return '', ''
+    return _clean(raw)
 
-    if len(letters) == 3 and len(digits) == 3:
-        plate_fixed = f"{''.join(letters)} {''.join(digits)}"
-    else:
-        plate_fixed = plate_part
+# clean_ocr_batch: normaliza una columna de respuestas; las repetidas se calculan una sola vez
 
-    # si no hay coma, tomar lo que sigue como ciudad
-    if not rest_text:
-        # todo lo que quede despues de los digitos
-        m = re.search(r'[0-9]{3}(.*)', s)
-        if m:
-            rest_text = m.group(1).strip().lstrip(',').strip()
+def clean_ocr_batch(raws):
+    unique = {r: clean_ocr_text(r) for r in set(r for r in raws if isinstance(r, str))}
+    return [unique.get(r, ('', '')) if isinstance(r, str) else ('', '') for r in raws]
 
-    return plate_fixed, rest_text
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vuelve a normalizar la columna OCR_bruto de un CSV de resultados")
+    parser.add_argument("csv_in")
+    parser.add_argument("--out", default=None, help="CSV de salida (por defecto sobreescribe la entrada)")
+    parser.add_argument("--municipios", default=None, help="archivo con un municipio por linea")
+    args = parser.parse_args()
 
+    if args.municipios:
+        print("[CLEAN] Municipios cargados:", load_municipalities(args.municipios))
+    with open(args.csv_in, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+    cleaned = clean_ocr_batch([row["OCR_bruto"] for row in rows])
+    changed = 0
+    for row, (plate, city) in zip(rows, cleaned):
+        changed += (row["OCR_limpio"], row["Ciudad"]) != (plate, city)
+        row["OCR_limpio"], row["Ciudad"] = plate, city
+    with open(args.out or args.csv_in, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"[CLEAN] {len(rows)} filas, {changed} cambiaron")
@@ -0,0 +1,216 @@
+# ocr_local.py
+# OCR clasico solo con CPU para placas colombianas (formato fijo AAA 999):
+# segmentacion de caracteres por componentes conectados sobre la placa rectificada y clasificacion
+# k-NN con descriptores HOG, entrenado con las imagenes de data/placas (el nombre del archivo es la placa)
+import os
+import cv2
+import argparse
+import threading
+import numpy as np
+import metrics
+from ocr import OCREngine
+
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+DIGITS = "0123456789"
+GLYPH_W, GLYPH_H = 16, 32
+
+CELL, BINS = 4, 9
+
+def to_gray(img):
+    if img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+# segment_characters: caracteres grandes de la fila superior de la placa (la ciudad es mas pequena)
+# devuelve las imagenes binarias de cada caracter ordenadas de izquierda a derecha
+
+def segment_characters(img, n_expected=6):
+    gray = to_gray(img)
+    H, W = gray.shape
+    _, bw = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(bw)
+
+    # el warp puede cortar el borde superior de los caracteres, asi que no se descartan los que tocan
+    # el borde; los marcos y tornillos se eliminan por tamano y proporcion
+    x, y, w, h, area = stats[1:].T
+    ok = (h > 0.25 * H) & (h < 0.8 * H) & (w < 0.25 * W) & (w > 0.18 * h) & (w < 1.0 * h) \
+        & (y + h / 2.0 < 0.7 * H) & (area > 0.15 * w * h)
+    idx = np.flatnonzero(ok) + 1
+    if idx.size == 0:
+        return []
+
+    # quedarse con los de altura similar a la mediana (caracteres de la placa)
+    hs = stats[idx, cv2.CC_STAT_HEIGHT]
+    idx = idx[np.abs(hs - np.median(hs)) <= 0.2 * np.median(hs)]
+    if idx.size > n_expected:
+        idx = idx[np.argsort(-stats[idx, cv2.CC_STAT_AREA])[:n_expected]]
+    idx = idx[np.argsort(stats[idx, cv2.CC_STAT_LEFT])]
+
+    glyphs = []
+    for i in idx:
+        cx, cy, cw, ch = stats[i, :4]
+        glyph = (labels[cy:cy + ch, cx:cx + cw] == i).astype(np.uint8) * 255
+        glyphs.append(normalize_glyph(glyph))
+    return glyphs
+
+def normalize_glyph(glyph):
+    # centra el caracter en un lienzo de proporcion GLYPH_W x GLYPH_H sin deformarlo
+    h, w = glyph.shape
+    side_h = max(h, int(np.ceil(w * GLYPH_H / GLYPH_W)))
+    side_w = int(np.ceil(side_h * GLYPH_W / GLYPH_H))
+    canvas = np.zeros((side_h, side_w), dtype=np.uint8)
+    oy, ox = (side_h - h) // 2, (side_w - w) // 2
+    canvas[oy:oy + h, ox:ox + w] = glyph
+    return cv2.resize(canvas, (GLYPH_W, GLYPH_H), interpolation=cv2.INTER_AREA)
+
+# glyph_features: HOG (celdas 4x4, 9 orientaciones, bloques 2x2 normalizados L2)
+# implementado con numpy porque cv2.HOGDescriptor no existe en todas las versiones de OpenCV
+
+def glyph_features(glyph):
+    g = glyph.astype(np.float32)
+    gx = cv2.Sobel(g, cv2.CV_32F, 1, 0, ksize=1)
+    gy = cv2.Sobel(g, cv2.CV_32F, 0, 1, ksize=1)
+    mag, ang = cv2.cartToPolar(gx, gy, angleInDegrees=True)
+    bins = ((ang % 180.0) * (BINS / 180.0)).astype(np.int32) % BINS
+
+    cy, cx = GLYPH_H // CELL, GLYPH_W // CELL
+    cell_idx = (np.arange(GLYPH_H)[:, None] // CELL) * cx + (np.arange(GLYPH_W)[None, :] // CELL)
+    hist = np.bincount((cell_idx * BINS + bins).ravel(), weights=mag.ravel(),
+                       minlength=cy * cx * BINS).reshape(cy, cx, BINS)
+
+    blocks = np.concatenate([hist[:-1, :-1], hist[1:, :-1], hist[:-1, 1:], hist[1:, 1:]], axis=2)
+    blocks /= np.sqrt((blocks ** 2).sum(axis=2, keepdims=True)) + 1e-6
+    return blocks.ravel().astype(np.float32)
+
+# augment: variaciones pequenas (desplazamiento, grosor) para ampliar los pocos ejemplos por clase
+
+def augment(glyph):
+    k = np.ones((2, 2), np.uint8)
+    out = [glyph, cv2.erode(glyph, k), cv2.dilate(glyph, k)]
+    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+        M = np.float32([[1, 0, dx], [0, 1, dy]])
+        out.append(cv2.warpAffine(glyph, M, (GLYPH_W, GLYPH_H)))
+    return out
+
+# render_glyphs: plantillas sinteticas (fuente Hershey) para las clases que no aparecen en el dataset
+
+def render_glyphs(chars):
+    samples = []
+    for ch in chars:
+        for font in (cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX):
+            for thick in (4, 6):
+                img = np.zeros((80, 80), np.uint8)
+                cv2.putText(img, ch, (12, 66), font, 2.2, 255, thick, cv2.LINE_AA)
+                ys, xs = np.nonzero(img > 127)
+                glyph = (img[ys.min():ys.max() + 1, xs.min():xs.max() + 1] > 127).astype(np.uint8) * 255
+                samples.append((ch, normalize_glyph(glyph)))
+    return samples
+
+# collect_glyphs: recorre una carpeta etiquetada (ABC123.jpg) y devuelve [(caracter, glifo)]
+# solo usa las placas donde se segmentan exactamente 6 caracteres
+
+def collect_glyphs(folder):
+    from main import detect_plate
+
+    samples = []
+    exts = (".jpg", ".jpeg", ".png")
+    for fname in sorted(os.listdir(folder)):
+        label = os.path.splitext(fname)[0].upper()
+        if not fname.lower().endswith(exts) or len(label) != 6:
+            continue
+        plates, error = detect_plate(os.path.join(folder, fname))
+        if error is not None:
+            continue
+        glyphs = segment_characters(plates[0])
+        if len(glyphs) != 6:
+            continue
+        samples.extend(zip(label, glyphs))
+    return samples
+
+def train(folders, out_path=None):
+    samples = []
+    for folder in folders:
+        samples.extend(collect_glyphs(folder))
+    n_real = len(samples)
+    samples.extend(render_glyphs(LETTERS + DIGITS))
+
+    feats, labels = [], []
+    for ch, glyph in samples:
+        for g in augment(glyph):
+            feats.append(glyph_features(g))
+            labels.append(ch)
+    feats = np.asarray(feats, dtype=np.float32)
+    labels = np.asarray(labels)
+    print(f"[FNC ocr_local.train] {n_real} caracteres reales, {len(feats)} muestras con aumentos")
+    if out_path:
+        np.savez_compressed(out_path, feats=feats, labels=labels)
+        print("[FNC ocr_local.train] Modelo guardado en", out_path)
+    return feats, labels
+
+# TemplateOCR: motor OCR local (milisegundos por placa)
+# devuelve "AAA 999" con una confianza 0..1 (margen entre la clase ganadora y la siguiente)
+
+class TemplateOCR(OCREngine):
+    def __init__(self, model_path="ocr_templates.npz", train_dirs=("data/placas",), k=3):
+        self.model_path = model_path
+        self.train_dirs = train_dirs
+        self.k = k
+        self.feats = None
+        self.labels = None
+        self._lock = threading.Lock()
+
+    def warmup(self):
+        with self._lock:
+            if self.feats is not None:
+                return True
+            if self.model_path and os.path.exists(self.model_path):
+                data = np.load(self.model_path)
+                self.feats, self.labels = data["feats"], data["labels"]
+            else:
+                self.feats, self.labels = train(self.train_dirs, out_path=self.model_path)
+            self._letters = np.isin(self.labels, list(LETTERS))
+        return True
+
+    def classify(self, glyph, letter):
+        # solo se comparan clases validas para la posicion (letras en 0-2, digitos en 3-5)
+        allowed = self._letters if letter else ~self._letters
+        feats, labels = self.feats[allowed], self.labels[allowed]
+        dist = np.linalg.norm(feats - glyph_features(glyph), axis=1)
+        order = np.argsort(dist)
+
+        votes, nearest = {}, {}
+        for i in order[:self.k]:
+            votes[labels[i]] = votes.get(labels[i], 0) + 1
+            nearest.setdefault(labels[i], dist[i])
+        # empate de votos: gana la clase con el vecino mas cercano
+        best = max(votes, key=lambda c: (votes[c], -nearest[c]))
+
+        d_best = dist[labels == best].min()
+        others = dist[labels != best]
+        d_other = others.min() if others.size else d_best * 2
+        conf = float(np.clip(1.0 - d_best / (d_other + 1e-6), 0.0, 1.0)) * 2
+        return best, min(conf, 1.0)
+
+    @metrics.timed("ocr_local")
+    def read_scored(self, img):
+        self.warmup()
+        glyphs = segment_characters(img)
+        if len(glyphs) != 6:
+            return None, 0.0
+        chars, confs = [], []
+        for i, glyph in enumerate(glyphs):
+            ch, conf = self.classify(glyph, letter=i < 3)
+            chars.append(ch)
+            confs.append(conf)
+        text = "".join(chars[:3]) + " " + "".join(chars[3:])
+        return text, min(confs)
+
+    def read(self, img, prompt_user=None):
+        return self.read_scored(img)[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrena el OCR local de caracteres")
+    parser.add_argument("folders", nargs="*", default=["data/placas"])
+    parser.add_argument("--out", default="ocr_templates.npz")
+    args = parser.parse_args()
+    train(args.folders, out_path=args.out)
@@ -0,0 +1,136 @@
+# results_store.py
+# almacen de resultados (SQLite, solo se agregan filas) indexado por ruta + hash del contenido
+# permite reanudar una corrida interrumpida y procesar solo las imagenes nuevas o modificadas;
+# el CSV de resultados pasa a ser una vista que se arma desde aqui
+import os
+import csv
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+# fallos que dependen solo de la imagen (y de la configuracion): no se reintentan al reanudar;
+# ocr_none (ollama caido, timeout) si se reintenta
+DETERMINISTIC_FAILURES = ("imread", "no_contour", "no_candidate", "empty_warp", "preprocess",
+                          "gate_area", "gate_fill", "gate_aspect", "gate_edges", "gate_chars")
+
+CSV_HEADER = ["Archivo", "OCR_bruto", "OCR_limpio", "Ciudad", "Tiempo_s", "Candidato"]
+
+def file_hash(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ResultsStore:
+    def __init__(self, path="resultados.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # una fila por placa candidata leida; un fallo es una fila con candidate = -1 y error
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " path TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " candidate INTEGER NOT NULL,"
+            " raw TEXT,"
+            " plate TEXT,"
+            " city TEXT,"
+            " elapsed REAL,"
+            " error TEXT,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_key ON results(path, hash, created)")
+        self._conn.commit()
+
+    # _latest: filas de la ultima corrida que proceso (path, hash)
+    def _latest(self, path, digest):
+        return self._conn.execute(
+            "SELECT candidate, raw, plate, city, elapsed, error FROM results"
+            " WHERE path = ? AND hash = ? AND created = ("
+            "  SELECT MAX(created) FROM results WHERE path = ? AND hash = ?)"
+            " ORDER BY candidate", (path, digest, path, digest)
+        ).fetchall()
+
+    # done: la imagen ya tiene resultado (lecturas o un fallo deterministico) con este contenido
+    def done(self, path, digest, retry_failed=False):
+        with self._lock:
+            rows = self._latest(path, digest)
+        if not rows:
+            return False
+        errors = [r[5] for r in rows if r[5] is not None]
+        if not errors:
+            return True
+        return not retry_failed and all(e in DETERMINISTIC_FAILURES for e in errors)
+
+    # rows: lecturas guardadas de la imagen como (raw, plate, city, elapsed, candidate)
+    def rows(self, path, digest):
+        with self._lock:
+            rows = self._latest(path, digest)
+        return [(raw, plate, city, elapsed, cand) for cand, raw, plate, city, elapsed, error in rows
+                if error is None]
+
+    # put: guarda el resultado de una imagen en una transaccion (lecturas o el motivo de fallo)
+    def put(self, path, digest, readings=None, error=None):
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                if error is not None:
+                    self._conn.execute(
+                        "INSERT INTO results (path, hash, candidate, error, created) VALUES (?, ?, -1, ?, ?)",
+                        (path, digest, error, now))
+                for raw, plate, city, elapsed, cand in readings or []:
+                    self._conn.execute(
+                        "INSERT INTO results (path, hash, candidate, raw, plate, city, elapsed, created)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (path, digest, cand, raw, plate, city, elapsed, now))
+
+    # export_csv: vista CSV con el ultimo resultado de cada (ruta, hash); rutas relativas a `root`
+    def export_csv(self, csv_out, root=None):
+        with self._lock:
+            keys = self._conn.execute("SELECT DISTINCT path, hash FROM results ORDER BY path").fetchall()
+            latest = {}
+            for path, digest in keys:
+                rows = self._latest(path, digest)
+                created = self._conn.execute("SELECT MAX(created) FROM results WHERE path = ? AND hash = ?",
+                                             (path, digest)).fetchone()[0]
+                # si el archivo cambio quedan varias versiones: se exporta la mas reciente
+                if path not in latest or created > latest[path][0]:
+                    latest[path] = (created, rows)
+        n = 0
+        with open(csv_out, mode="w", newline="", encoding="utf-8") as fcsv:
+            writer = csv.writer(fcsv)
+            writer.writerow(CSV_HEADER)
+            for path, (created, rows) in latest.items():
+                name = os.path.relpath(path, root) if root else path
+                for cand, raw, plate, city, elapsed, error in rows:
+                    if error is None:
+                        writer.writerow([name, raw, plate, city, f"{elapsed:.3f}", cand])
+                        n += 1
+        return n
+
+    def stats(self):
+        with self._lock:
+            images, failed = self._conn.execute(
+                "SELECT COUNT(DISTINCT path || hash), COUNT(DISTINCT CASE WHEN error IS NOT NULL THEN path || hash END)"
+                " FROM results").fetchone()
+        return {"images": images, "failed": failed}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta el almacen de resultados a CSV")
+    parser.add_argument("store", nargs="?", default="resultados.db")
+    parser.add_argument("--csv", default="resultados.csv")
+    parser.add_argument("--root", default=None, help="escribir las rutas relativas a esta carpeta")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    n = store.export_csv(args.csv, root=args.root)
+    print(f"[STORE] {n} filas exportadas a {args.csv} | {store.stats()}")
@@ -0,0 +1,376 @@
+# server.py
+# servicio ALPR residente: expone mascara -> contorno -> warp -> preprocesado -> OCR como endpoint HTTP
+# que recibe los bytes de la imagen. cv2/numpy/ollama, la tabla de color, el preprocesador y el modelo
+# se cargan una sola vez; los controladores de porteria o los demonios de camara solo envian cuadros.
+# - POST /recognize   cuerpo = bytes JPEG/PNG; ?candidates=N&detect_width=W&camera=NOMBRE opcionales
+# - GET  /health      estado, solicitudes en curso y version de la configuracion
+# - GET  /metrics     metricas Prometheus (si se activan con --metrics)
+# Concurrencia: pool de hilos fijo para la etapa CPU (los buffers del preprocesador son por hilo y se
+# reutilizan) y otro para el OCR (limita las solicitudes simultaneas a ollama); las solicitudes que
+# superan workers + cola se rechazan con 503 y las que no terminan a tiempo responden 504.
+# La respuesta incluye los tiempos de cada etapa (espera en cola, decodificacion, deteccion, OCR).
+import os
+import cv2
+import json
+import time
+import signal
+import argparse
+import threading
+import socketserver
+import numpy as np
+import debug
+import metrics
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from ocr_cache import OCRCache
+from ocr_clean import clean_ocr_text, PLATE_RE
+from ingest import REDUCED_FLAGS
+from main import detect_bgr, make_engine, configure_engine, engine_timeout, pinned_fields, FAILURES
+from config import ConfigStore
+from calibration import HSVCalibrator
+
+FAILURES = dict(FAILURES, imdecode="No se pudo decodificar la imagen")
+
+# ALPRService: estado residente del servicio (motor OCR, configuracion, pools y admision)
+
+class ALPRService:
+    def __init__(self, engine, store=None, cpu_workers=2, ocr_workers=1, max_queue=16, timeout=None,
+                 detect_width=None, color_lut=False, candidates=0, decode_reduce=1, max_bytes=20 << 20,
+                 calibrator=None):
+        self.engine = engine
+        # calibrator: umbrales HSV por camara (?camera=) y franja horaria, aprendidos de las placas leidas
+        self.calibrator = calibrator
+        self.store = store or ConfigStore()
+        self.version = self.store.version
+        # timeout = None: se deriva del motor OCR (ver timeout), asi sigue al ocr.timeout recargado
+        self._timeout = timeout
+        self.detect_width = detect_width
+        self.color_lut = color_lut
+        self.candidates = candidates
+        self.decode_flag = REDUCED_FLAGS[decode_reduce]
+        self.max_bytes = max_bytes
+        self.cpu_workers = cpu_workers
+        self.max_pending = cpu_workers + ocr_workers + max_queue
+        self.cpu_pool = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="alpr-cpu")
+        self.ocr_pool = ThreadPoolExecutor(max_workers=ocr_workers, thread_name_prefix="alpr-ocr")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.served = 0
+        self.rejected = 0
+
+    # timeout: plazo por solicitud; por defecto el timeout del motor mas un margen para la deteccion y la cola
+    @property
+    def timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        return engine_timeout(self.engine) + 30.0
+
+    # _enter / _leave: admision; pending cuenta las solicitudes con trabajo en algun pool o en cola
+    def _enter(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            self.served += 1
+            n = self.served
+        metrics.add_gauge("alpr_queue_depth", 1, queue="requests")
+        return n
+
+    def _leave(self, future=None):
+        with self._lock:
+            self.pending -= 1
+        metrics.add_gauge("alpr_queue_depth", -1, queue="requests")
+
+    # _config: configuracion vigente; si el archivo cambio se aplica tambien al motor OCR
+    def _config(self):
+        cfg = self.store.get()
+        if self.store.version != self.version:
+            with self._lock:
+                if self.store.version != self.version:
+                    self.version = self.store.version
+                    configure_engine(self.engine, cfg.ocr)
+        return cfg
+
+    # warmup: carga el modelo y pasa imagenes vacias por la etapa CPU (crea los hilos, la tabla de color
+    # y los buffers del preprocesador antes de la primera solicitud)
+    def warmup(self):
+        blank = np.zeros((240, 320, 3), np.uint8)
+        cfg = self._config()
+        list(self.cpu_pool.map(lambda _: detect_bgr(blank, color_lut=self.color_lut, cfg=cfg),
+                               range(self.cpu_workers)))
+        return self.engine.warmup()
+
+    def _detect(self, data, name, detect_width, candidates, camera, hists):
+        t_start = time.perf_counter()
+        bgr = cv2.imdecode(np.frombuffer(data, np.uint8), self.decode_flag)
+        t_decoded = time.perf_counter()
+        if bgr is None:
+            return None, "imdecode", t_start, t_decoded, t_decoded
+        cfg = self._config()
+        if self.calibrator is not None:
+            cfg = self.calibrator.apply(cfg, camera)
+        dbg = debug.begin(name)
+        plates, error = detect_bgr(bgr, name, detect_width=detect_width, color_lut=self.color_lut,
+                                   candidates=candidates, cfg=cfg, dbg=dbg, hists=hists)
+        if dbg is not None:
+            dbg.finish(error)
+        return plates, error, t_start, t_decoded, time.perf_counter()
+
+    def _ocr(self, plates, camera, hists):
+        t_start = time.perf_counter()
+        results = self.engine.read_batch(plates)
+        if hists:
+            for raw, hist in zip(results, hists):
+                if raw is not None and PLATE_RE.match(clean_ocr_text(raw)[0]):
+                    self.calibrator.observe(camera, hist)
+        return results, t_start, time.perf_counter()
+
+    # recognize: procesa una imagen y devuelve (codigo HTTP, respuesta JSON)
+    def recognize(self, data, detect_width=None, candidates=None, camera="default"):
+        t0 = time.perf_counter()
+        timings = {}
+        n = self._enter()
+        if not n:
+            return self._reply(503, t0, timings, {"ok": False, "error": "busy", "message": "Servicio saturado, reintente"})
+
+        stage, future = "detect", None
+        hists = [] if self.calibrator is not None else None
+        try:
+            future = self.cpu_pool.submit(self._detect, data, f"req{n:06d}",
+                                          detect_width if detect_width is not None else self.detect_width,
+                                          candidates if candidates is not None else self.candidates, camera, hists)
+            plates, error, t_start, t_decoded, t_end = future.result(timeout=self._remaining(t0))
+            timings.update(queue_ms=(t_start - t0) * 1e3, decode_ms=(t_decoded - t_start) * 1e3,
+                           detect_ms=(t_end - t_decoded) * 1e3)
+            if error is not None:
+                metrics.inc("alpr_failures_total", reason=error)
+                return self._reply(400 if error == "imdecode" else 200, t0, timings,
+                                   {"ok": False, "error": error, "message": FAILURES[error], "readings": []})
+
+            stage = "ocr"
+            t_submit = time.perf_counter()
+            future = self.ocr_pool.submit(self._ocr, plates, camera, hists)
+            results, t_start, t_end = future.result(timeout=self._remaining(t0))
+            timings.update(ocr_queue_ms=(t_start - t_submit) * 1e3, ocr_ms=(t_end - t_start) * 1e3)
+        except FutureTimeout:
+            # si aun no empezo se cancela; si ya corre termina en su hilo y libera la admision al final
+            future.cancel()
+            metrics.inc("alpr_failures_total", reason="timeout")
+            return self._reply(504, t0, timings, {"ok": False, "error": "timeout", "stage": stage,
+                                                  "message": f"Sin respuesta en {self.timeout:.1f} s"})
+        except Exception as e:
+            print(f"[SERVER] ERROR en solicitud {n} ({stage}):", str(e))
+            metrics.inc("alpr_failures_total", reason="internal")
+            return self._reply(500, t0, timings, {"ok": False, "error": "internal", "message": str(e)})
+        finally:
+            if future is None:
+                self._leave()
+            else:
+                future.add_done_callback(self._leave)
+
+        if all(r is None for r in results):
+            metrics.inc("alpr_failures_total", reason="ocr_none")
+            return self._reply(502, t0, timings, {"ok": False, "error": "ocr_none", "message": FAILURES["ocr_none"],
+                                                  "readings": []})
+        readings = []
+        for cand, raw in enumerate(results):
+            if raw is None:
+                continue
+            plate, city = clean_ocr_text(raw)
+            readings.append({"candidate": cand, "raw": raw, "plate": plate, "city": city})
+        return self._reply(200, t0, timings, {"ok": True, "error": None, "readings": readings})
+
+    def _remaining(self, t0):
+        return max(0.0, self.timeout - (time.perf_counter() - t0))
+
+    def _reply(self, status, t0, timings, body):
+        total = time.perf_counter() - t0
+        timings["total_ms"] = total * 1e3
+        body["timings_ms"] = {k: round(v, 2) for k, v in timings.items()}
+        body["config_version"] = self.version
+        metrics.observe("request", total)
+        metrics.inc("alpr_requests_total", status=str(status))
+        return status, body
+
+    def health(self):
+        with self._lock:
+            return {"status": "ok", "pending": self.pending, "max_pending": self.max_pending,
+                    "served": self.served, "rejected": self.rejected, "config_version": self.version}
+
+    def close(self):
+        self.cpu_pool.shutdown(wait=True)
+        self.ocr_pool.shutdown(wait=True)
+        if self.calibrator is not None:
+            self.calibrator.save()
+
+class _ALPRHandler(BaseHTTPRequestHandler):
+    service = None
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, self.service.health())
+        elif path == "/metrics" and metrics.enabled():
+            self._send(200, metrics.prometheus_text().encode(), "text/plain; version=0.0.4")
+        else:
+            self._send_json(404, {"ok": False, "error": "not_found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/recognize":
+            self._send_json(404, {"ok": False, "error": "not_found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self._send_json(411, {"ok": False, "error": "length_required"})
+            return
+        if length > self.service.max_bytes:
+            self._send_json(413, {"ok": False, "error": "too_large"})
+            self.close_connection = True
+            return
+        data = self.rfile.read(length)
+        params = parse_qs(url.query)
+        try:
+            query = {k: int(v[-1]) for k, v in params.items() if k in ("candidates", "detect_width")}
+        except ValueError:
+            self._send_json(400, {"ok": False, "error": "bad_query"})
+            return
+        if "camera" in params:
+            query["camera"] = params["camera"][-1]
+        status, body = self.service.recognize(data, **query)
+        if status == 503:
+            self._send_json(status, body, {"Retry-After": "1"})
+        else:
+            self._send_json(status, body)
+
+    def _send_json(self, status, body, headers=None):
+        self._send(status, json.dumps(body).encode(), "application/json", headers)
+
+    def _send(self, status, payload, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+# servidor TCP con una cola de conexiones mas larga que la de la libreria (5) para rafagas de clientes
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 128
+
+# servidor sobre socket Unix: para clientes en la misma maquina sin pasar por TCP
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+# serve: arranca el servidor HTTP (puerto TCP o socket Unix) y bloquea hasta Ctrl+C
+
+def serve(service, host="127.0.0.1", port=8080, unix_socket=None):
+    handler = type("Handler", (_ALPRHandler,), {"service": service})
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, handler)
+        where = f"unix:{unix_socket}"
+    else:
+        server = _Server((host, port), handler)
+        where = f"http://{host}:{port}"
+    print(f"[SERVER] Escuchando en {where} (POST /recognize, GET /health)")
+    # SIGTERM (systemd, docker stop) cierra igual que Ctrl+C: termina lo pendiente y guarda la calibracion
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[SERVER] Deteniendo")
+    finally:
+        server.server_close()
+        service.close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        print("[SERVER] Resumen:", service.health())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servicio HTTP residente de deteccion y OCR de placas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", default=None, help="escuchar en este socket Unix en vez de TCP")
+    parser.add_argument("--cpu-workers", type=int, default=os.cpu_count() or 2,
+                        help="hilos para mascara, contorno, warp y preprocesado")
+    parser.add_argument("--ocr-workers", type=int, default=1, help="solicitudes OCR simultaneas")
+    parser.add_argument("--max-queue", type=int, default=16,
+                        help="solicitudes en espera antes de responder 503")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="tiempo maximo por solicitud (s) antes de responder 504 "
+                             "(por defecto el timeout del motor OCR mas 30 s)")
+    parser.add_argument("--max-bytes", type=int, default=20 << 20)
+    parser.add_argument("--detect-width", type=int, default=None)
+    parser.add_argument("--color-lut", action="store_true")
+    parser.add_argument("--candidates", type=int, default=0)
+    parser.add_argument("--decode-reduce", type=int, choices=[1, 2, 4, 8], default=1)
+    parser.add_argument("--ocr-engine", choices=["ollama", "local", "local+ollama"], default="ollama")
+    parser.add_argument("--templates", default="ocr_templates.npz")
+    parser.add_argument("--min-confidence", type=float, default=0.4)
+    parser.add_argument("--min-sharpness", type=float, default=100.0)
+    parser.add_argument("--min-contrast", type=float, default=80.0)
+    parser.add_argument("--plate-only", action="store_true",
+                        help="cascada local+ollama: no consultar ollama por la ciudad de las placas seguras")
+    parser.add_argument("--ocr-batch", type=int, default=1,
+                        help="juntar placas de solicitudes concurrentes en lotes de hasta N (ollama)")
+    parser.add_argument("--ocr-batch-wait", type=float, default=0.05)
+    parser.add_argument("--config", default=None,
+                        help="archivo TOML/YAML de configuracion; se recarga si cambia")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--keep-alive", default=None)
+    parser.add_argument("--cache", default="ocr_cache.db")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--calibration", default=None,
+                        help="archivo .npz de calibracion HSV por camara (?camera=) y franja horaria (se actualiza)")
+    parser.add_argument("--debug-dir", default=None)
+    parser.add_argument("--debug-sample", type=float, default=1.0)
+    parser.add_argument("--debug-failures", action="store_true")
+    parser.add_argument("--metrics", action="store_true", help="exponer /metrics en el mismo servidor")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable()
+    if args.debug_dir:
+        debug.configure(args.debug_dir, sample=args.debug_sample, failures_only=args.debug_failures)
+
+    store = ConfigStore(args.config)
+    ocr_cfg = store.get().ocr
+    engine = make_engine(args.ocr_engine, model=args.model or ocr_cfg.model,
+                         keep_alive=args.keep_alive or ocr_cfg.keep_alive, timeout=ocr_cfg.timeout,
+                         retries=ocr_cfg.retries, options=ocr_cfg.options(),
+                         cache=None if args.no_cache else OCRCache(args.cache),
+                         templates=args.templates, min_confidence=args.min_confidence,
+                         min_sharpness=args.min_sharpness, min_contrast=args.min_contrast,
+                         plate_only=args.plate_only,
+                         batch_size=args.ocr_batch, batch_wait=args.ocr_batch_wait, batch_workers=args.ocr_workers,
+                         pinned=pinned_fields(args))
+
+    # con lotes, las placas de varias solicitudes se juntan: hacen falta mas hilos esperando en el OCR
+    service = ALPRService(engine, store=store, cpu_workers=args.cpu_workers,
+                          ocr_workers=args.ocr_workers * args.ocr_batch, max_queue=args.max_queue,
+                          timeout=args.timeout, detect_width=args.detect_width, color_lut=args.color_lut,
+                          candidates=args.candidates, decode_reduce=args.decode_reduce, max_bytes=args.max_bytes,
+                          calibrator=HSVCalibrator(args.calibration) if args.calibration else None)
+    start_time = time.time()
+    service.warmup()
+    print(f"[SERVER] Listo en {time.time() - start_time:.3f} s")
+    serve(service, host=args.host, port=args.port, unix_socket=args.unix)
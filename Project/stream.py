@@ -0,0 +1,479 @@
+# stream.py
+# modo video: lee de cv2.VideoCapture (archivo, RTSP o indice de camara), detecta la placa en cada
+# cuadro, la sigue entre cuadros y envia a OCR una sola vez por placa, con su cuadro mas nitido
+import os
+import cv2
+import csv
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import debug
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from ocr_cache import OCRCache
+from ocr_clean import clean_ocr_text, PLATE_RE
+from utils import locate_plate, get_warp_from_box, preprocess_plate, get_bgr_lut, gate_warp
+from main import make_engine, configure_engine, pinned_fields
+from config import ConfigStore, DEFAULT
+from calibration import HSVCalibrator, plate_histogram
+
+# FrameReader: hilo lector con cola acotada
+# en camaras en vivo (drop=True) se descarta el cuadro viejo si el procesamiento va atrasado;
+# en archivos (drop=False) el lector espera, asi no se pierden cuadros
+
+class FrameReader:
+    def __init__(self, source, drop=True, max_queue=2):
+        self.cap = cv2.VideoCapture(source)
+        self.drop = drop
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def opened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        idx = 0
+        while not self._stop.is_set():
+            ok, frame = self.cap.read()
+            if not ok:
+                break
+            item = (idx, frame)
+            idx += 1
+            if self.drop:
+                while True:
+                    try:
+                        self.frames.put_nowait(item)
+                        break
+                    except queue.Full:
+                        try:
+                            self.frames.get_nowait()
+                            self.dropped += 1
+                            metrics.inc("alpr_stream_dropped_total", reason="frame_lag")
+                        except queue.Empty:
+                            pass
+            else:
+                self._put_wait(item)
+        self._put_wait(None)
+
+    def _put_wait(self, item):
+        while not self._stop.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            yield item
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.cap.release()
+
+# sharpness: varianza del laplaciano sobre la placa rectificada
+
+def sharpness(warp):
+    gray = cv2.cvtColor(warp, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def box_to_rect(box):
+    x1, y1 = box.min(axis=0)
+    x2, y2 = box.max(axis=0)
+    return float(x1), float(y1), float(x2), float(y2)
+
+def iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+# Track: una placa seguida entre cuadros; guarda solo el mejor warp visto
+
+class Track:
+    def __init__(self, track_id, rect, frame_idx, warp, score):
+        self.id = track_id
+        self.rect = rect
+        self.first_frame = frame_idx
+        self.last_frame = frame_idx
+        self.hits = 1
+        self.best_warp = warp
+        self.best_score = score
+        self.best_frame = frame_idx
+
+    def update(self, rect, frame_idx, warp, score):
+        self.rect = rect
+        self.last_frame = frame_idx
+        self.hits += 1
+        if score > self.best_score:
+            self.best_warp = warp
+            self.best_score = score
+            self.best_frame = frame_idx
+
+# PlateTracker: asocia detecciones por IoU; una pista se cierra tras max_missed cuadros sin verla
+
+class PlateTracker:
+    def __init__(self, iou_thresh=0.3, max_missed=15, min_hits=3):
+        self.iou_thresh = iou_thresh
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.tracks = []
+        self._next_id = 1
+
+    def update(self, frame_idx, rect=None, warp=None, score=0.0):
+        if rect is not None:
+            best, best_iou = None, self.iou_thresh
+            for t in self.tracks:
+                v = iou(t.rect, rect)
+                if v >= best_iou:
+                    best, best_iou = t, v
+            if best is not None:
+                best.update(rect, frame_idx, warp, score)
+            else:
+                self.tracks.append(Track(self._next_id, rect, frame_idx, warp, score))
+                self._next_id += 1
+
+        return self._expire(lambda t: frame_idx - t.last_frame > self.max_missed)
+
+    # flush: cierra todas las pistas (fin del video)
+    def flush(self):
+        return self._expire(lambda t: True)
+
+    def _expire(self, done):
+        finished = [t for t in self.tracks if done(t)]
+        self.tracks = [t for t in self.tracks if not done(t)]
+        # pistas muy cortas suelen ser falsos positivos
+        return [t for t in finished if t.hits >= self.min_hits]
+
+# ROIManager: region de busqueda para camaras fijas (porterias, peajes), donde la placa aparece siempre en
+# la misma zona y se mueve poco entre cuadros
+# - con placa en el cuadro anterior se busca solo en una ventana alrededor de su caja (pad veces su
+#   tamano por lado); si ahi no aparece se vuelve a buscar en el mismo cuadro en el carril o completo
+# - carril: celdas de una grilla donde han aparecido placas; despues de lane_min detecciones la busqueda
+#   sin placa previa se hace solo en el rectangulo que las cubre
+# - cada full_every cuadros se busca en el cuadro completo, asi el carril sigue aprendiendo
+
+class ROIManager:
+    def __init__(self, pad=1.0, full_every=30, lane_min=20, grid=32):
+        self.pad = pad
+        self.full_every = full_every
+        self.lane_min = lane_min
+        self.grid = grid
+        self.shape = None
+        self.last = None         # rect (x1, y1, x2, y2) de la ultima placa, en coordenadas del cuadro
+        self.since_full = 0
+        self.hits = np.zeros((grid, grid), dtype=np.int32)
+        self.detections = 0
+        self.searches = {"roi": 0, "lane": 0, "full": 0}
+
+    # windows: busquedas a intentar en orden, [(modo, rect o None = cuadro completo)]
+    def windows(self, shape):
+        h, w = shape[:2]
+        if self.shape != (h, w):
+            # cambio de resolucion: lo aprendido ya no aplica
+            self.shape = (h, w)
+            self.last = None
+            self.since_full = self.full_every
+            self.hits[:] = 0
+            self.detections = 0
+        if self.since_full >= self.full_every:
+            return [("full", None)]
+        lane = self.lane()
+        fallback = ("lane", lane) if lane is not None else ("full", None)
+        if self.last is None:
+            return [fallback]
+        return [("roi", self._padded(self.last, self.pad)), fallback]
+
+    # update: resultado del cuadro (rect de la placa o None) y modo de la busqueda que lo dio
+    def update(self, mode, rect):
+        self.searches[mode] += 1
+        self.since_full = 0 if mode == "full" else self.since_full + 1
+        self.last = rect
+        if rect is None:
+            return
+        h, w = self.shape
+        gx1, gy1 = int(rect[0] * self.grid / w), int(rect[1] * self.grid / h)
+        gx2, gy2 = int(np.ceil(rect[2] * self.grid / w)), int(np.ceil(rect[3] * self.grid / h))
+        self.hits[max(0, gy1):gy2, max(0, gx1):gx2] += 1
+        self.detections += 1
+
+    # lane: rectangulo que cubre las celdas con placas (mas una celda por lado), o None si falta aprender
+    def lane(self):
+        if self.detections < self.lane_min:
+            return None
+        ys, xs = np.nonzero(self.hits)
+        if xs.size == 0:
+            return None
+        h, w = self.shape
+        cw, ch = w / self.grid, h / self.grid
+        return self._clip((xs.min() - 1) * cw, (ys.min() - 1) * ch, (xs.max() + 2) * cw, (ys.max() + 2) * ch)
+
+    def _padded(self, rect, pad):
+        x1, y1, x2, y2 = rect
+        px, py = (x2 - x1) * pad, (y2 - y1) * pad
+        return self._clip(x1 - px, y1 - py, x2 + px, y2 + py)
+
+    def _clip(self, x1, y1, x2, y2):
+        h, w = self.shape
+        return (max(0, int(x1)), max(0, int(y1)), min(w, int(np.ceil(x2))), min(h, int(np.ceil(y2))))
+
+# OCRDispatcher: envia placas a OCR sin cola ilimitada
+# como maximo ocr_workers + max_queue solicitudes pendientes; si no hay cupo la placa se descarta
+
+class OCRDispatcher:
+    def __init__(self, engine, writer, ocr_workers=1, max_queue=4, store=None, calibrator=None, camera="stream"):
+        self.engine = engine
+        self.writer = writer
+        self.store = store or ConfigStore()
+        # calibrator: las placas leidas con formato valido alimentan la calibracion HSV de la camara
+        self.calibrator = calibrator
+        self.camera = camera
+        self.pool = ThreadPoolExecutor(max_workers=ocr_workers)
+        self.slots = threading.BoundedSemaphore(ocr_workers + max_queue)
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+
+    def submit(self, track):
+        if not self.slots.acquire(blocking=False):
+            self.dropped += 1
+            metrics.inc("alpr_stream_dropped_total", reason="ocr_busy")
+            print(f"[STREAM] OCR saturado, se descarta placa {track.id} (cuadro {track.best_frame})")
+            return False
+        self.sent += 1
+        metrics.add_gauge("alpr_queue_depth", 1, queue="ocr_pending")
+        self.pool.submit(self._run, track)
+        return True
+
+    def _run(self, track):
+        try:
+            plate = preprocess_plate(track.best_warp, params=self.store.get().preprocess, gray=True)
+            start_time = time.time()
+            ocr_result = self.engine.read(plate) if plate is not None else None
+            elapsed = time.time() - start_time
+            if ocr_result is None:
+                metrics.inc("alpr_failures_total", reason="ocr_none")
+                print(f"[STREAM] [ERROR] OCR fallo para placa {track.id}")
+                return
+            plate_fixed, city = clean_ocr_text(ocr_result)
+            if self.calibrator is not None and PLATE_RE.match(plate_fixed):
+                self.calibrator.observe(self.camera, plate_histogram(track.best_warp))
+            print(f"[RESULT] Placa {track.id} | Cuadros {track.first_frame}-{track.last_frame} | Mejor: {track.best_frame} "
+                  f"| OCR bruto: {ocr_result} | OCR limpio: {plate_fixed}, {city} | Tiempo: {elapsed:.3f} s")
+            with self.lock:
+                self.writer.writerow([track.id, track.first_frame, track.last_frame, track.best_frame,
+                                      ocr_result, plate_fixed, city, f"{elapsed:.3f}"])
+        finally:
+            metrics.add_gauge("alpr_queue_depth", -1, queue="ocr_pending")
+            self.slots.release()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+# detect_frame: dbg = DebugRecord opcional del cuadro (debug.begin); se cierra aqui con el motivo de fallo
+
+def detect_frame(bgr, detect_width=None, lut=None, cfg=None, dbg=None, frame_shape=None):
+    cfg = cfg or DEFAULT
+    cnt, box, reason = locate_plate(bgr, *cfg.hsv.bounds(), max_width=detect_width, lut=lut, gate=cfg.gate,
+                                    dbg=dbg, frame_shape=frame_shape)
+    if cnt is None:
+        metrics.inc("alpr_failures_total", reason=reason)
+        if dbg is not None:
+            dbg.finish(reason)
+        return None, None
+    warp, M, size = get_warp_from_box(box, bgr, target_h=cfg.warp.target_h, min_w=cfg.warp.min_w,
+                                      expand_px=cfg.warp.expand_px, dbg=dbg)
+    reason = "empty_warp" if warp is None else gate_warp(warp, cfg.gate) if cfg.gate.enabled else None
+    if reason is not None:
+        metrics.inc("alpr_failures_total", reason=reason)
+        if dbg is not None:
+            if warp is not None:
+                dbg.add("warp", warp)
+            dbg.finish(reason)
+        return None, None
+    if dbg is not None:
+        dbg.add("warp", warp)
+        dbg.finish()
+    return box, warp
+
+# detect_roi: detect_frame en las ventanas de ROIManager (vistas del cuadro, sin copia); la caja se
+# devuelve en coordenadas del cuadro completo y detect_width se escala al ancho de la ventana
+
+def detect_roi(frame, roi, idx, detect_width=None, lut=None, cfg=None):
+    for mode, rect in roi.windows(frame.shape):
+        if rect is None:
+            x1, y1, crop, width = 0, 0, frame, detect_width
+        else:
+            x1, y1, x2, y2 = rect
+            crop = frame[y1:y2, x1:x2]
+            width = max(1, detect_width * (x2 - x1) // frame.shape[1]) if detect_width else None
+        metrics.inc("alpr_stream_search_total", mode=mode)
+        box, warp = detect_frame(crop, width, lut, cfg, debug.begin(f"cuadro{idx:06d}_{mode}"),
+                                 frame_shape=frame.shape)
+        if box is not None:
+            box = box + np.array([x1, y1], dtype=box.dtype)
+            roi.update(mode, box_to_rect(box))
+            return box, warp
+    roi.update(mode, None)
+    return None, None
+
+def run_stream(source, engine, csv_out="resultados_video.csv", skip=1, drop=None,
+               ocr_workers=1, max_queue=4, max_missed=15, min_hits=3, detect_width=None,
+               color_lut=False, store=None, calibrator=None, camera="stream", roi=None):
+    # drop por defecto: descartar cuadros solo en camaras / streams en vivo
+    if drop is None:
+        drop = isinstance(source, int) or "://" in str(source)
+
+    reader = FrameReader(source, drop=drop)
+    if not reader.opened():
+        print("[STREAM] [ERROR] No se pudo abrir la fuente:", source)
+        return
+
+    # store: ConfigStore; los cambios del archivo se aplican desde el siguiente cuadro
+    store = store or ConfigStore()
+    version = store.version
+    tracker = PlateTracker(max_missed=max_missed, min_hits=min_hits)
+    start_time = time.time()
+    processed = 0
+
+    with open(csv_out, mode="w", newline="", encoding="utf-8") as fcsv:
+        writer = csv.writer(fcsv)
+        writer.writerow(["Placa", "Cuadro_inicio", "Cuadro_fin", "Cuadro_mejor",
+                         "OCR_bruto", "OCR_limpio", "Ciudad", "Tiempo_s"])
+        dispatcher = OCRDispatcher(engine, writer, ocr_workers=ocr_workers, max_queue=max_queue, store=store,
+                                   calibrator=calibrator, camera=camera)
+        reader.start()
+        try:
+            for idx, frame in reader:
+                if idx % skip:
+                    continue
+                processed += 1
+                metrics.inc("alpr_frames_total")
+                metrics.set_gauge("alpr_queue_depth", reader.frames.qsize(), queue="frames")
+                cfg = store.get()
+                if store.version != version:
+                    version = store.version
+                    configure_engine(engine, cfg.ocr)
+                if calibrator is not None:
+                    cfg = calibrator.apply(cfg, camera)
+                lut = get_bgr_lut(*cfg.hsv.bounds()) if color_lut else None
+                if roi is not None:
+                    box, warp = detect_roi(frame, roi, idx, detect_width, lut, cfg)
+                else:
+                    box, warp = detect_frame(frame, detect_width, lut, cfg, debug.begin(f"cuadro{idx:06d}"))
+                if box is None:
+                    finished = tracker.update(idx)
+                else:
+                    finished = tracker.update(idx, box_to_rect(box), warp, sharpness(warp))
+                for track in finished:
+                    dispatcher.submit(track)
+        except KeyboardInterrupt:
+            print("\n[STREAM] Interrumpido")
+        finally:
+            reader.stop()
+            for track in tracker.flush():
+                dispatcher.submit(track)
+            dispatcher.close()
+            if calibrator is not None:
+                calibrator.save()
+
+    elapsed = time.time() - start_time
+    fps = processed / elapsed if elapsed > 0 else 0.0
+    print(f"\n[STREAM] Cuadros procesados: {processed} ({fps:.1f} fps) | descartados por lectura: {reader.dropped} "
+          f"| placas a OCR: {dispatcher.sent} | descartadas por OCR saturado: {dispatcher.dropped}")
+    if roi is not None:
+        print("[STREAM] Busquedas por modo:", roi.searches, "| carril:", roi.lane())
+    if hasattr(engine, "stats"):
+        print("[STREAM] Cascada OCR:", engine.stats())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deteccion y OCR de placas en video")
+    parser.add_argument("source", help="archivo de video, URL RTSP o indice de camara (0, 1, ...)")
+    parser.add_argument("--csv", default="resultados_video.csv")
+    parser.add_argument("--skip", type=int, default=1, help="procesar 1 de cada N cuadros")
+    parser.add_argument("--drop", action="store_true", default=None,
+                        help="descartar cuadros si el procesamiento va atrasado (por defecto solo en vivo)")
+    parser.add_argument("--ocr-workers", type=int, default=1)
+    parser.add_argument("--max-queue", type=int, default=4, help="placas en espera de OCR antes de descartar")
+    parser.add_argument("--max-missed", type=int, default=15, help="cuadros sin ver la placa para cerrar la pista")
+    parser.add_argument("--min-hits", type=int, default=3, help="cuadros minimos para considerar una placa")
+    parser.add_argument("--detect-width", type=int, default=None,
+                        help="ancho maximo para la deteccion (piramide); el warp usa el cuadro original")
+    parser.add_argument("--color-lut", action="store_true",
+                        help="mascara desde BGR con tabla precalculada (sin conversion HSV)")
+    parser.add_argument("--roi", action="store_true",
+                        help="camara fija: buscar alrededor de la ultima placa y en el carril aprendido")
+    parser.add_argument("--roi-pad", type=float, default=1.0,
+                        help="margen de la ventana alrededor de la ultima placa (veces su tamano)")
+    parser.add_argument("--roi-full-every", type=int, default=30,
+                        help="buscar en el cuadro completo cada N cuadros procesados")
+    parser.add_argument("--roi-lane-min", type=int, default=20,
+                        help="detecciones antes de restringir la busqueda al carril aprendido")
+    parser.add_argument("--ocr-engine", choices=["ollama", "local", "local+ollama"], default="ollama")
+    parser.add_argument("--templates", default="ocr_templates.npz")
+    parser.add_argument("--min-confidence", type=float, default=0.4)
+    parser.add_argument("--min-sharpness", type=float, default=100.0)
+    parser.add_argument("--min-contrast", type=float, default=80.0)
+    parser.add_argument("--plate-only", action="store_true",
+                        help="cascada local+ollama: no consultar ollama por la ciudad de las placas seguras")
+    parser.add_argument("--config", default=None,
+                        help="archivo TOML/YAML con umbrales, warp, preprocesado y OCR; se recarga si cambia")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--keep-alive", default=None)
+    parser.add_argument("--cache", default="ocr_cache.db")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--calibration", default=None,
+                        help="archivo .npz de calibracion HSV por camara y franja horaria (se actualiza)")
+    parser.add_argument("--camera", default=None,
+                        help="nombre de la camara para la calibracion (por defecto el de la fuente)")
+    parser.add_argument("--debug-dir", default=None,
+                        help="guardar mascara, contorno, puntos y warp por cuadro en esta carpeta")
+    parser.add_argument("--debug-sample", type=float, default=1.0,
+                        help="fraccion de cuadros con artefactos de depuracion (0..1)")
+    parser.add_argument("--debug-failures", action="store_true",
+                        help="guardar artefactos solo de los cuadros sin placa")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="exponer metricas Prometheus en este puerto (/metrics)")
+    args = parser.parse_args()
+
+    if args.metrics_port is not None:
+        metrics.enable()
+        metrics.serve_http(args.metrics_port)
+
+    if args.debug_dir:
+        debug.configure(args.debug_dir, sample=args.debug_sample, failures_only=args.debug_failures)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    cache = None if args.no_cache else OCRCache(args.cache)
+    store = ConfigStore(args.config)
+    ocr_cfg = store.get().ocr
+    engine = make_engine(args.ocr_engine, model=args.model or ocr_cfg.model,
+                         keep_alive=args.keep_alive or ocr_cfg.keep_alive, timeout=ocr_cfg.timeout,
+                         retries=ocr_cfg.retries, options=ocr_cfg.options(), cache=cache,
+                         templates=args.templates, min_confidence=args.min_confidence,
+                         min_sharpness=args.min_sharpness, min_contrast=args.min_contrast,
+                         plate_only=args.plate_only,
+                         pinned=pinned_fields(args))
+    engine.warmup()
+    calibrator = HSVCalibrator(args.calibration) if args.calibration else None
+    camera = args.camera or (f"cam{source}" if isinstance(source, int) else os.path.basename(str(source)))
+    roi = ROIManager(pad=args.roi_pad, full_every=max(1, args.roi_full_every),
+                     lane_min=args.roi_lane_min) if args.roi else None
+
+    run_stream(source, engine, csv_out=args.csv, skip=max(1, args.skip), drop=args.drop,
+               ocr_workers=args.ocr_workers, max_queue=args.max_queue,
+               max_missed=args.max_missed, min_hits=args.min_hits, detect_width=args.detect_width,
+               color_lut=args.color_lut, store=store, calibrator=calibrator, camera=camera, roi=roi)
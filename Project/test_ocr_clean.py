@@ -0,0 +1,22 @@
+# test_ocr_clean.py
+# casos de normalizacion de la respuesta OCR (placa y ciudad)
+#   python -m pytest -q test_ocr_clean.py
+from ocr_clean import clean_ocr_text, match_city
+
+# match_city: se devuelve el municipio del indice, sin las palabras repetidas o sobrantes
+
+def test_match_city_duplicated_token():
+    assert match_city("MONTERIA MONTERIA") == "MONTERIA"
+
+def test_match_city_trailing_words():
+    assert match_city("CALI VALLE") == "CALI"
+    assert match_city("SANTANA MARTIA P") == "SANTA MARTA"
+
+def test_match_city_multiword_name():
+    assert match_city("BOGOTA DC") == "BOGOTA DC"
+
+def test_clean_ocr_text_duplicated_city():
+    assert clean_ocr_text("BOT 577, MONTERIA MONTERIA") == ("BOT 577", "MONTERIA")
+
+def test_clean_ocr_text_city_only():
+    assert clean_ocr_text("CALI") == ("", "CALI")
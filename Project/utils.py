@@ -1,22 +1,95 @@
 # utils.py
+import sys
 import cv2
+import threading
+from collections import OrderedDict
 import numpy as np
+import debug
+import metrics
+from config import PreprocessConfig, GateConfig
 
-# create_mask: convierte a HSV, crea mascara y aplica morfologia
+# BGRMaskLUT: clasificador BGR -> mascara precalculado a partir de los umbrales HSV
+# tabla de 2^24 bytes (una entrada por color BGR) construida una sola vez con cvtColor + inRange,
+# asi que el resultado es identico al de la conversion HSV pero sin el buffer HSV de 3 canales
+
+class BGRMaskLUT:
+    def __init__(self, hmin, hmax, smin, smax, vmin, vmax):
+        lower = np.array([hmin, smin, vmin], dtype=np.uint8)
+        upper = np.array([hmax, smax, vmax], dtype=np.uint8)
+
+        # se construye por planos de R (256x256 colores cada uno) para no crear el cubo completo en memoria
+        g, b = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing="ij")
+        plane = np.empty((256, 256, 3), dtype=np.uint8)
+        plane[..., 0] = b
+        plane[..., 1] = g
+        self.table = np.empty(1 << 24, dtype=np.uint8)
+        for r in range(256):
+            plane[..., 2] = r
+            hsv = cv2.cvtColor(plane, cv2.COLOR_BGR2HSV)
+            # indice = R<<16 | G<<8 | B
+            self.table[r << 16:(r + 1) << 16] = cv2.inRange(hsv, lower, upper).ravel()
+
+        self._scratch = threading.local()
 
-def create_mask(bgr, hmin, hmax, smin, smax, vmin, vmax):
-    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+    # apply: mascara directa desde BGR; la mascara es nueva en cada llamada (del que llama) y los buffers
+    # intermedios (BGRA, indices) son por hilo, asi la misma tabla se comparte entre hilos del servicio
+    def apply(self, bgr):
+        h, w = bgr.shape[:2]
+        buf = self._scratch
+        if getattr(buf, "shape", None) != (h, w):
+            buf.bgra = np.empty((h, w, 4), dtype=np.uint8)
+            buf.idx = np.empty((h, w), dtype=np.uint32)
+            buf.shape = (h, w)
 
-    lower = np.array([hmin, smin, vmin], dtype=np.uint8)
-    upper = np.array([hmax, smax, vmax], dtype=np.uint8)
+        # BGRA visto como uint32 (little endian) = B | G<<8 | R<<16 | A<<24
+        cv2.cvtColor(bgr, cv2.COLOR_BGR2BGRA, dst=buf.bgra)
+        packed = buf.bgra.view(np.uint32)[..., 0]
+        if sys.byteorder == "little":
+            np.bitwise_and(packed, 0xFFFFFF, out=buf.idx)
+        else:
+            # big endian: B<<24 | G<<16 | R<<8 | A -> R<<16 | G<<8 | B
+            np.right_shift(packed, 8, out=buf.idx)
+            buf.idx[...] = ((buf.idx & 0xFF) << 16) | (buf.idx & 0xFF00) | (buf.idx >> 16)
+        return np.take(self.table, buf.idx)
+
+# get_bgr_lut: una tabla por proceso y por umbrales (construirla toma ~0.1 s)
+# se guardan las ultimas MAX_LUTS (16 MB cada una): con calibracion por camara / franja horaria
+# los umbrales cambian, y sin limite cada juego de umbrales quedaria en memoria
+# el servicio HTTP la llama desde varios hilos: el cache va con lock (y una tabla se construye una vez)
+MAX_LUTS = 4
+_luts = OrderedDict()
+_luts_lock = threading.Lock()
+
+def get_bgr_lut(hmin, hmax, smin, smax, vmin, vmax):
+    key = (hmin, hmax, smin, smax, vmin, vmax)
+    with _luts_lock:
+        if key in _luts:
+            _luts.move_to_end(key)
+        else:
+            _luts[key] = BGRMaskLUT(*key)
+            while len(_luts) > MAX_LUTS:
+                _luts.popitem(last=False)
+        return _luts[key]
+
+# create_mask: convierte a HSV, crea mascara y aplica morfologia
+# con lut (BGRMaskLUT) la mascara sale directo de BGR, sin la imagen HSV intermedia
 
-    h, w, _ = hsv.shape
+@metrics.timed("create_mask")
+def create_mask(bgr, hmin, hmax, smin, smax, vmin, vmax, lut=None):
+    h, w = bgr.shape[:2]
     k = max(3, min(15, w // 100))  # escala: 3..15
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (k, k))
 
-    mask = cv2.inRange(hsv, lower, upper)
-    white_pixels = int(mask.sum() / 255)
-    
+    if lut is not None:
+        mask = lut.apply(bgr)
+    else:
+        hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+
+        lower = np.array([hmin, smin, vmin], dtype=np.uint8)
+        upper = np.array([hmax, smax, vmax], dtype=np.uint8)
+
+        mask = cv2.inRange(hsv, lower, upper)
+
     mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=1)
     
@@ -24,6 +97,7 @@ def create_mask(bgr, hmin, hmax, smin, smax, vmin, vmax):
     
 # find_largest_contour: busca contornos y devuelve el mayor y su caja
 
+@metrics.timed("find_largest_contour")
 def find_largest_contour(mask, kernel):
     mask_closed = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
     contours, _ = cv2.findContours(mask_closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -53,6 +127,185 @@ def find_largest_contour(mask, kernel):
 
     return cnt, box
 
+# find_plate_candidates: como find_largest_contour pero devuelve varias placas posibles ordenadas
+# por puntaje [(puntaje, contorno, caja), ...]. Los filtros geometricos (area relativa al cuadro,
+# aspecto de la caja minima y relleno de la mascara) usan los umbrales de la compuerta (gate, GateConfig;
+# por defecto los de config.py) y se evaluan como arreglos numpy sobre todos los contornos; despues
+# gate_contour revisa cada candidata como en el modo de un solo contorno. Con la compuerta apagada
+# solo se ordena. reasons: lista opcional donde se agrega el motivo si no queda ninguna candidata
+
+PLATE_ASPECT = 2.06  # placa colombiana 330 x 160 mm
+
+@metrics.timed("find_plate_candidates")
+def find_plate_candidates(mask, kernel, max_candidates=3, gate=None, reasons=None):
+    gate = gate or GateConfig()
+    mask_closed = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    contours, _ = cv2.findContours(mask_closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return []
+
+    frame_area = float(mask.shape[0] * mask.shape[1])
+    areas = np.array([cv2.contourArea(c) for c in contours], dtype=np.float64)
+
+    # primer filtro: area minima (descarta el ruido antes de calcular cajas)
+    min_area = gate.min_area_frac * frame_area if gate.enabled else 0.0
+    idx = np.flatnonzero((areas >= min_area) & (areas > 0))
+    rects = [cv2.minAreaRect(contours[i]) for i in idx]
+    sides = np.array([r[1] for r in rects], dtype=np.float64).reshape(-1, 2)
+    long_side, short_side = sides.max(axis=1), sides.min(axis=1)
+    aspect = long_side / (short_side + 1e-5)
+    rectangularity = np.minimum(areas[idx] / (long_side * short_side + 1e-5), 1.0)
+
+    # relleno: fraccion de pixeles de la mascara (sin cerrar) dentro de la caja alineada
+    bounds = np.array([cv2.boundingRect(contours[i]) for i in idx], dtype=np.int64).reshape(-1, 4)
+    fill = np.array([cv2.countNonZero(mask[y:y + h, x:x + w]) / float(w * h) for x, y, w, h in bounds])
+
+    area_frac = areas[idx] / frame_area
+    aspect_score = np.exp(-((aspect - PLATE_ASPECT) / 0.75) ** 2)
+    score = np.sqrt(area_frac) * aspect_score * rectangularity * fill
+    if gate.enabled:
+        keep = (aspect >= gate.min_aspect) & (aspect <= gate.max_aspect) & (fill >= gate.min_fill)
+        score[~keep] = 0.0
+
+    candidates = []
+    for j in np.argsort(-score):
+        if score[j] <= 0 or len(candidates) == max_candidates:
+            break
+        cnt = contours[idx[j]]
+        box = cv2.boxPoints(rects[j]).astype(np.float32)
+        if gate.enabled and gate_contour(cnt, box, mask, gate) is not None:
+            continue
+        candidates.append((float(score[j]), cnt, box))
+
+    if not candidates and gate.enabled:
+        # motivo del contorno mas grande, el mismo que daria el modo de un solo contorno
+        cnt = contours[int(np.argmax(areas))]
+        box = cv2.boxPoints(cv2.minAreaRect(cnt)).astype(np.float32)
+        reason = gate_contour(cnt, box, mask, gate)
+        if reason is not None and reasons is not None:
+            reasons.append(reason)
+    return candidates
+
+# pyr_downscale: reduce la imagen con piramide (pyrDown) hasta que el ancho sea <= max_width
+# devuelve la copia reducida y el factor (sx, sy) para volver a coordenadas originales
+
+@metrics.timed("pyr_downscale")
+def pyr_downscale(bgr, max_width=None):
+    small = bgr
+    if max_width:
+        while small.shape[1] > max_width and min(small.shape[:2]) >= 2:
+            small = cv2.pyrDown(small)
+    sx = bgr.shape[1] / small.shape[1]
+    sy = bgr.shape[0] / small.shape[0]
+    return small, (sx, sy)
+
+# gate_contour: compuerta barata entre el contorno y el warp (microsegundos, sobre la mascara ya hecha)
+# rechaza manchas amarillas muy pequenas respecto al cuadro, con poco relleno de mascara dentro de su caja
+# alineada o con aspecto lejos del de una placa; devuelve el motivo ("gate_area", ...) o None
+
+@metrics.timed("gate_contour")
+def gate_contour(cnt, box, mask, gate, frame_area=None):
+    # frame_area: area del cuadro completo en pixeles de la mascara cuando la mascara es de una ventana
+    area = cv2.contourArea(cnt) / float(frame_area or mask.shape[0] * mask.shape[1])
+    if area < gate.min_area_frac:
+        return _reject("gate_area", f"area {area:.5f} < {gate.min_area_frac}")
+
+    x, y, w, h = cv2.boundingRect(cnt)
+    fill = cv2.countNonZero(mask[y:y + h, x:x + w]) / float(w * h)
+    if fill < gate.min_fill:
+        return _reject("gate_fill", f"relleno {fill:.2f} < {gate.min_fill}")
+
+    side_a = np.linalg.norm(box[1] - box[0])
+    side_b = np.linalg.norm(box[2] - box[1])
+    aspect = max(side_a, side_b) / (min(side_a, side_b) + 1e-5)
+    if not gate.min_aspect <= aspect <= gate.max_aspect:
+        return _reject("gate_aspect", f"aspecto {aspect:.2f} fuera de [{gate.min_aspect}, {gate.max_aspect}]")
+    return None
+
+# gate_warp: revision rapida del warp antes del preprocesado y del OCR, sobre una copia de 48 px de alto:
+# densidad de bordes (Canny) y cantidad de componentes con tamano de caracter (umbral adaptativo)
+
+GATE_HEIGHT = 48
+
+@metrics.timed("gate_warp")
+def gate_warp(warp, gate):
+    gray = cv2.cvtColor(warp, cv2.COLOR_BGR2GRAY) if warp.ndim == 3 else warp
+    w = max(1, int(round(gray.shape[1] * GATE_HEIGHT / gray.shape[0])))
+    gray = cv2.resize(gray, (w, GATE_HEIGHT), interpolation=cv2.INTER_AREA)
+
+    edges = cv2.countNonZero(cv2.Canny(gray, 50, 150)) / float(gray.size)
+    if edges < gate.min_edge_density:
+        return _reject("gate_edges", f"densidad de bordes {edges:.3f} < {gate.min_edge_density}")
+
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 10)
+    n, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=4)
+    ch, cw = stats[1:, cv2.CC_STAT_HEIGHT], stats[1:, cv2.CC_STAT_WIDTH]
+    chars = int(np.count_nonzero((ch >= 0.25 * GATE_HEIGHT) & (ch <= 0.95 * GATE_HEIGHT) &
+                                 (cw >= 0.015 * w) & (cw <= 0.2 * w)))
+    if chars < gate.min_chars:
+        return _reject("gate_chars", f"caracteres {chars} < {gate.min_chars}")
+    return None
+
+def _reject(reason, detail):
+    print(f"[FNC gate] Rechazada ({reason}): {detail}")
+    metrics.inc("alpr_gate_rejected_total", reason=reason)
+    return reason
+
+# locate_plate: mascara + contorno (+ compuerta si gate.enabled) sobre la copia reducida; contorno y caja
+# en coordenadas de la imagen original, para que get_warp_from_box muestree el warp a resolucion completa
+# devuelve (contorno, caja, None) o (None, None, motivo). frame_shape: forma del cuadro completo cuando
+# bgr es una ventana (ROI de stream.py)
+
+def locate_plate(bgr, hmin, hmax, smin, smax, vmin, vmax, max_width=None, lut=None, gate=None, dbg=None,
+                 frame_shape=None):
+    small, (sx, sy) = pyr_downscale(bgr, max_width)
+    mask, kernel = create_mask(small, hmin, hmax, smin, smax, vmin, vmax, lut=lut)
+    cnt, box = find_largest_contour(mask, kernel)
+    if dbg is not None:
+        dbg.add("mask", mask)
+        if cnt is not None:
+            dbg.add("contour", small, debug.draw_contours([cnt]))
+    if cnt is None:
+        return None, None, "no_contour"
+    if gate is not None and gate.enabled:
+        frame_area = None
+        if frame_shape is not None:
+            # bgr es una ventana del cuadro: min_area_frac se mide contra el cuadro completo
+            frame_area = mask.size * (frame_shape[0] * frame_shape[1]) / float(bgr.shape[0] * bgr.shape[1])
+        reason = gate_contour(cnt, box, mask, gate, frame_area)
+        if reason is not None:
+            return None, None, reason
+    if small is bgr:
+        return cnt, box, None
+
+    scale = np.array([sx, sy], dtype=np.float32)
+    box = box * scale
+    cnt = np.round(cnt * scale).astype(np.int32)
+    return cnt, box, None
+
+# find_plate_box: locate_plate sin compuerta; devuelve (contorno, caja) o (None, None)
+
+def find_plate_box(bgr, hmin, hmax, smin, smax, vmin, vmax, max_width=None, lut=None, dbg=None):
+    cnt, box, reason = locate_plate(bgr, hmin, hmax, smin, smax, vmin, vmax, max_width=max_width, lut=lut, dbg=dbg)
+    return cnt, box
+
+# find_plate_candidates_box: find_plate_candidates sobre la copia reducida, cajas en coordenadas originales
+
+def find_plate_candidates_box(bgr, hmin, hmax, smin, smax, vmin, vmax, max_width=None, lut=None,
+                              max_candidates=3, gate=None, reasons=None, dbg=None):
+    small, (sx, sy) = pyr_downscale(bgr, max_width)
+    mask, kernel = create_mask(small, hmin, hmax, smin, smax, vmin, vmax, lut=lut)
+    candidates = find_plate_candidates(mask, kernel, max_candidates=max_candidates, gate=gate, reasons=reasons)
+    if dbg is not None:
+        dbg.add("mask", mask)
+        if candidates:
+            dbg.add("contour", small, debug.draw_contours([cnt for score, cnt, box in candidates]))
+    if small is bgr:
+        return candidates
+
+    scale = np.array([sx, sy], dtype=np.float32)
+    return [(score, np.round(cnt * scale).astype(np.int32), box * scale) for score, cnt, box in candidates]
+
     
 def expand_box(src_points, expand_px=5):
     # src_points: array de 4 puntos (tl, tr, br, bl)
@@ -65,16 +318,15 @@ def expand_box(src_points, expand_px=5):
     return expanded
     
 # get_warp_from_box: ordena puntos, calcula homografia y genera warp
-def get_warp_from_box(box, image, target_h=240, min_w=120):
+# dbg: DebugRecord opcional (debug.begin); los puntos se dibujan en el hilo escritor, no aqui
+@metrics.timed("get_warp_from_box")
+def get_warp_from_box(box, image, target_h=240, min_w=120, expand_px=8, dbg=None):
     src = order_points(box)
-    
-    debug_points = image.copy()
-    for (x, y) in src.astype(int):
-    	cv2.circle(debug_points, (x, y), 5, (0, 255, 0), -1)
-    cv2.imwrite("debug_points.jpg", debug_points)
-    #print("[DEBUG] Puntos fuente guardados en debug_points.jpg")
 
-    src = expand_box(src, expand_px=8)  # anade margen de 8 pixeles
+    if dbg is not None:
+        dbg.add("points", image, debug.draw_points(src))
+
+    src = expand_box(src, expand_px=expand_px)  # anade margen (8 pixeles por defecto)
        
     wA = np.linalg.norm(src[2] - src[3])  # br - bl
     wB = np.linalg.norm(src[1] - src[0])  # tr - tl
@@ -106,40 +358,91 @@ def get_warp_from_box(box, image, target_h=240, min_w=120):
     #print("[FNC get_warp_from_box] Warp generado correctamente")
     return warp, M, (target_w, target_h)
     
- # preprocess_plate: CLAHE, bilateral, blur+sharpen y guardado
- 
-def preprocess_plate(img, out_path="data/placas_procesadas/plate_prepoc.jpg", target_h=None):
-    # img: imagen BGR rectificada (warp)
-    # out_path: ruta donde se guardara la imagen resultante
-    #print("[FNC preprocess_plate] Iniciando preprocesado")
+# PlatePreprocessor: preprocesado con estado (CLAHE, bilateral, blur+sharpen)
+# el objeto CLAHE se crea una vez (y de nuevo solo si cambian los parametros) y los intermedios
+# (gris, CLAHE, bilateral, blur) se escriben con dst= en buffers reutilizados; como el ancho del warp
+# cambia con el aspecto, cada buffer es un arreglo plano que solo crece y se usa una vista contigua
+# del tamano de la placa. No es seguro entre hilos: usar get_preprocessor() (uno por hilo)
 
-    if img is None:
-        print("[FNC preprocess_plate] Error: imagen de entrada es None")
-        return None
+class PlatePreprocessor:
+    def __init__(self, params=None):
+        self.params = None
+        self.clahe = None
+        self._flat = {}
+        self.configure(params or PreprocessConfig())
+
+    def configure(self, params):
+        if params == self.params:
+            return
+        tile = (params.clahe_tile, params.clahe_tile)
+        if self.clahe is None or params.clahe_clip != self.params.clahe_clip or params.clahe_tile != self.params.clahe_tile:
+            self.clahe = cv2.createCLAHE(clipLimit=params.clahe_clip, tileGridSize=tile)
+        self.params = params
+
+    def _buffer(self, name, shape):
+        size = shape[0] * shape[1]
+        flat = self._flat.get(name)
+        if flat is None or flat.size < size:
+            flat = self._flat[name] = np.empty(size, dtype=np.uint8)
+        return flat[:size].reshape(shape)
 
-    #print("[FNC preprocess_plate] Conversion a gris")
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # apply: devuelve la placa en gris (gray=True) o BGR; la salida es un arreglo nuevo (sale del hilo)
+    def apply(self, img, gray=False):
+        p = self.params
+        shape = img.shape[:2]
+        g = self._buffer("gray", shape)
+        eq = self._buffer("clahe", shape)
+        bil = self._buffer("bilateral", shape)
+        blur = self._buffer("blur", shape)
 
-    #print("[FNC preprocess_plate] Aplicando CLAHE")
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    gray = clahe.apply(gray)
+        if img.ndim == 3:
+            cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=g)
+        else:
+            g[...] = img
+        self.clahe.apply(g, dst=eq)
+        # bilateralFilter no admite src y dst en el mismo buffer
+        cv2.bilateralFilter(eq, p.bilateral_d, p.bilateral_sigma_color, p.bilateral_sigma_space, dst=bil)
+        cv2.GaussianBlur(bil, (0, 0), p.sharpen_sigma, dst=blur)
+        sharp = cv2.addWeighted(bil, 1.0 + p.sharpen_amount, blur, -p.sharpen_amount, 0)
+        if gray:
+            return sharp
+        return cv2.cvtColor(sharp, cv2.COLOR_GRAY2BGR)
 
-    #print("[FNC preprocess_plate] Aplicando filtro bilateral (reduccion de ruido)")
-    gray = cv2.bilateralFilter(gray, d=5, sigmaColor=50, sigmaSpace=50)
+_local = threading.local()
 
-    #print("[FNC preprocess_plate] Aplicando desenfoque y realce (sharpen)")
-    blur  = cv2.GaussianBlur(gray, (0, 0), 1.0)
-    sharp = cv2.addWeighted(gray, 1.5, blur, -0.5, 0)
+def get_preprocessor(params=None):
+    pre = getattr(_local, "preprocessor", None)
+    if pre is None:
+        pre = _local.preprocessor = PlatePreprocessor(params)
+    elif params is not None:
+        pre.configure(params)
+    return pre
 
-    #print(f"[FNC preprocess_plate] Convirtiendo a BGR y guardando en: {out_path}")
-    out = cv2.cvtColor(sharp, cv2.COLOR_GRAY2BGR)
-    ok = cv2.imwrite(out_path, out)
-    if not ok:
-        print("[FNC preprocess_plate] Error guardando archivo:", out_path)
+# preprocess_plate: CLAHE, bilateral, blur+sharpen; devuelve la imagen procesada
+# si se indica out_path tambien se guarda en disco (opcional)
+# gray=True devuelve la placa en gris (1 canal) sin la expansion a BGR; el OCR (JPEG, plantillas,
+# calidad) acepta gris, asi que el pipeline la pide asi
+
+@metrics.timed("preprocess_plate")
+def preprocess_plate(img, out_path=None, target_h=None, params=None, gray=False):
+    # img: imagen BGR rectificada (warp)
+    # out_path: ruta donde se guardara la imagen resultante (None = no guardar)
+    # params: PreprocessConfig (None = valores por defecto)
+    #print("[FNC preprocess_plate] Iniciando preprocesado")
+
+    if img is None:
+        print("[FNC preprocess_plate] Error: imagen de entrada es None")
         return None
 
-    #print("[FNC preprocess_plate] Preprocesado completado:", out_path)
-    return out_path
+    out = get_preprocessor(params or PreprocessConfig()).apply(img, gray=gray)
+    if out_path is not None:
+        ok = cv2.imwrite(out_path, out)
+        if not ok:
+            print("[FNC preprocess_plate] Error guardando archivo:", out_path)
+            return None
+
+    #print("[FNC preprocess_plate] Preprocesado completado")
+    return out
 
 def order_points(pts):
     # pts: array de 4 puntos (x,y)